@@ -0,0 +1,141 @@
+# asyncio facade for the motion engines
+#
+# Wraps a multiprocessing Stepper or a StepScheduler motor so moves can be
+# awaited from one event loop next to the web UI and sensors:
+#
+#   m1, m2 = AsyncMotor(stepper1), AsyncMotor(stepper2)
+#   await m1.go_angle(90)
+#   await asyncio.gather(m1.go_angle(0), m2.rotate(-45))
+#   task = asyncio.create_task(m1.rotate(360))
+#   task.cancel()                   # the motor stops at its current step
+#
+# AsyncController does the same for a SyncController running its background
+# loop, whose motors move in lockstep:
+#
+#   ctrl.attach(m1, m2); ctrl.start()
+#   c = AsyncController(ctrl)
+#   await c.go_angle(m1, 90)        # True once m1 is there
+#   await c.wait_all()              # every attached motor at its target
+#
+# Nothing blocks and nothing polls: each engine writes a byte to its
+# notify_fd whenever a command finishes (a SyncController whenever its
+# motors arrive, or it stops), the loop watches that fd with
+# add_reader(), and the waiting futures whose handles are done resolve.
+# Cancelling an awaiting task cancels that command, and only that one, on
+# the motor; a coroutine whose command was cancelled elsewhere gets False.
+
+import asyncio
+import os
+
+
+# One reader per notify fd and loop; StepScheduler motors share a fd
+# (handles need done(), cancelled() and rejected)
+class _FdWatch:
+    watches = {}    # (loop, fd) -> _FdWatch
+
+    def __init__(self, loop, fd):
+        self.loop, self.fd = loop, fd
+        self.waiting = []       # (handle, future)
+        loop.add_reader(fd, self._readable)
+
+    @classmethod
+    def get(cls, loop, fd):
+        w = cls.watches.get((loop, fd))
+        if w is None:
+            w = cls.watches[(loop, fd)] = cls(loop, fd)
+        return w
+
+    def add(self, handle, fut):
+        self.waiting.append((handle, fut))
+        self._check()               # it may have finished before we got here
+
+    def _readable(self):
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        self._check()
+
+    def _check(self):
+        still = []
+        for handle, fut in self.waiting:
+            if fut.done():
+                continue
+            if handle.done():
+                fut.set_result(not handle.cancelled())
+            else:
+                still.append((handle, fut))
+        self.waiting = still
+        if not still:               # stop watching until the next move
+            self.loop.remove_reader(self.fd)
+            del _FdWatch.watches[(self.loop, self.fd)]
+
+
+class AsyncMotor:
+    def __init__(self, motor):
+        self.motor = motor      # Stepper or ScheduledStepper
+
+    @property
+    def angle(self) -> float:
+        return self.motor.angle.value
+
+    # Wait for a command's handle without blocking the loop.  Returns False
+    # if the engine rejected the command (a full queue with drop_newest) or
+    # it was cancelled by someone else; cancelling the awaiting task cancels
+    # just this command.
+    async def _await(self, handle) -> bool:
+        if handle.rejected:
+            return False
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        _FdWatch.get(loop, self.motor.notify_fd).add(handle, fut)
+        try:
+            return await fut
+        except asyncio.CancelledError:
+            self.motor.cancel(handle)
+            raise
+
+    async def rotate(self, delta, profile=None) -> bool:
+        return await self._await(self.motor.rotate(delta, profile))
+
+    async def go_angle(self, target_angle, profile=None) -> bool:
+        return await self._await(self.motor.goAngle(target_angle, profile))
+
+    async def run_program(self, moves, profile=None) -> bool:
+        return await self._await(self.motor.run_program(moves, profile))
+
+    # Finish everything sent so far (True once all of it is done)
+    async def wait(self) -> bool:
+        h = self.motor._handle(self.motor._issued)
+        return await self._await(h) or h.done()
+
+    def cancel(self):
+        self.motor.cancel()
+
+
+class AsyncController:
+    def __init__(self, ctrl):
+        self.ctrl = ctrl        # SyncController with its background loop started
+
+    # Wait until the motors of an arrival handle are at their targets.
+    # False if the controller stopped first.
+    async def _await(self, arrival) -> bool:
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        _FdWatch.get(loop, self.ctrl.notify_fd).add(arrival, fut)
+        return await fut
+
+    # Move motor to an absolute angle; cancelling the awaiting task stops
+    # it where it is
+    async def go_angle(self, motor, target_angle, profile=None) -> bool:
+        motor.goAngle(target_angle, profile)
+        try:
+            return await self._await(self.ctrl.arrival([motor]))
+        except asyncio.CancelledError:
+            motor.target_step = motor.step_pos
+            raise
+
+    # Every attached motor at its target
+    async def wait_all(self) -> bool:
+        return await self._await(self.ctrl.arrival())
@@ -0,0 +1,274 @@
+# Benchmark runner
+#
+#   python -m bench [--out bench_results.json] [--quick] [name ...]
+#
+# Runs everything on simulated GPIO (hc595_sim.HC595Chain, MemoryPWM), so it
+# works on any Linux box as well as on the Pi.  Results are written as JSON
+# so two runs can be diffed; each benchmark is one top-level key.
+#
+#   shift         frames/sec for Shifter.shiftByte and a 32-bit shiftWord
+#   stepper       achieved steps/sec and step jitter of the multiprocessing Stepper
+#   sync          the same for SyncController.run_until_all_reached
+#   scheduler     the same for three motors on one StepScheduler
+#   wait          wake-up latency of Stepper.wait() after the last step
+#   enqueue       time for Stepper.goAngle() to hand a command to the worker
+#                 (command ring), next to a plain multiprocessing.Queue put
+#   http          request throughput/latency of the lab7 problem 1/2 servers
+
+import argparse
+import importlib
+import json
+import multiprocessing
+import platform
+import socket
+import statistics
+import sys
+import time
+
+from shifter import Shifter
+from hc595_sim import HC595Chain
+from gpio_backends import MemoryPWM
+
+DATA, CLOCK, LATCH = 16, 21, 20
+
+
+# summary of a list of samples [ns]
+def _summary(samples_ns):
+    s = sorted(samples_ns)
+    if not s:
+        return {}
+    pick = lambda q: s[min(len(s) - 1, int(q * len(s)))] / 1e3
+    return {"n": len(s), "mean_us": statistics.fmean(s) / 1e3, "p50_us": pick(0.50),
+            "p99_us": pick(0.99), "max_us": s[-1] / 1e3,
+            "stdev_us": statistics.pstdev(s) / 1e3}
+
+
+# rate and jitter from latch timestamps [ns], one latch per step
+def _step_timing(stamps, configured_s):
+    intervals = [b - a for a, b in zip(stamps, stamps[1:])]
+    if not intervals:
+        return {}
+    mean = statistics.fmean(intervals)
+    return {"steps": len(stamps), "configured_steps_per_s": 1 / configured_s,
+            "achieved_steps_per_s": 1e9 / mean,
+            "interval": _summary(intervals),
+            "jitter_us": statistics.pstdev(intervals) / 1e3,
+            "worst_late_us": (max(intervals) - configured_s * 1e9) / 1e3}
+
+
+def _drain(q):
+    out = []
+    while True:
+        try:
+            out.append(q.get(timeout=0.2))
+        except Exception:
+            return out
+
+
+def bench_shift(quick):
+    n = 2000 if quick else 20000
+    res = {}
+    for name, bits, call in (("shiftByte", 8, lambda s, i: s.shiftByte(i & 0xFF)),
+                             ("shiftWord32", 32, lambda s, i: s.shiftWord(i * 0x9E3779B1, 32))):
+        chain = HC595Chain(DATA, CLOCK, LATCH, num_registers=bits // 8, keep=False)
+        s = Shifter(DATA, CLOCK, LATCH, backend=chain)
+        t0 = time.perf_counter_ns()
+        for i in range(n):
+            call(s, i)
+        dt = time.perf_counter_ns() - t0
+        res[name] = {"frames": n, "frames_per_s": n * 1e9 / dt,
+                     "pin_writes_per_frame": chain.writes / n,
+                     "pin_toggles_per_frame": chain.toggles / n,
+                     "violations": len(chain.violations)}
+    chain = HC595Chain(DATA, CLOCK, LATCH, keep=False)
+    s = Shifter(DATA, CLOCK, LATCH, backend=chain)
+    t0 = time.perf_counter_ns()
+    s.shiftFrames(range(n), 8)
+    dt = time.perf_counter_ns() - t0
+    res["shiftFrames"] = {"frames": n, "frames_per_s": n * 1e9 / dt}
+    return res
+
+
+def _stepper_module():
+    return importlib.import_module("stepper_class_shiftregister_multiprocessingFINALattempt")
+
+
+def bench_stepper(quick):
+    st = _stepper_module()
+    q = multiprocessing.Queue()
+    s = Shifter(DATA, CLOCK, LATCH, backend=HC595Chain(DATA, CLOCK, LATCH, keep=False, sink=q.put))
+    m = st.Stepper(s, multiprocessing.Lock())
+    deg = 10 if quick else 45
+    m.rotate(deg)
+    time.sleep(deg * st.Stepper.steps_per_degree * st.Stepper.delay / 1e6 + 0.5)
+    stamps = [t for t, _ in _drain(q)]
+    m.worker.terminate()
+    return _step_timing(stamps, st.Stepper.delay / 1e6)
+
+
+def bench_sync(quick):
+    m8 = importlib.import_module("stepper_class_shiftregister_multiprocessing8")
+    chain = HC595Chain(DATA, CLOCK, LATCH)
+    ctrl = m8.SyncController(shifter=Shifter(DATA, CLOCK, LATCH, backend=chain))
+    delay = 0.002
+    m1 = m8.Stepper("low", step_delay=delay)
+    m2 = m8.Stepper("high", step_delay=delay)
+    m1.goAngle(30 if quick else 90)
+    m2.goAngle(-15 if quick else -45)
+    ctrl.run_until_all_reached([m1, m2])
+    stamps = [t for t, _ in chain.latched[:-1]]     # last latch is the hold refresh
+    return _step_timing(stamps, delay)
+
+
+def bench_scheduler(quick):
+    from step_scheduler import StepScheduler
+    q = multiprocessing.Queue()
+    chain = HC595Chain(DATA, CLOCK, LATCH, num_registers=2, keep=False, sink=q.put)
+    sched = StepScheduler(Shifter(DATA, CLOCK, LATCH, backend=chain))
+    motors = [sched.add_motor() for _ in range(3)]
+    sched.start()
+    deg = 10 if quick else 45
+    for m in motors:
+        m.rotate(deg)
+    for m in motors:
+        m.wait()
+    sched.stop()
+    stamps = [t for t, _ in _drain(q)]
+    return _step_timing(stamps, StepScheduler.delay / 1e6)
+
+
+def bench_wait(quick):
+    ft = importlib.import_module("finaltest")
+    q = multiprocessing.Queue()
+    s = Shifter(DATA, CLOCK, LATCH, backend=HC595Chain(DATA, CLOCK, LATCH, keep=False, sink=q.put))
+    m = ft.Stepper(s, multiprocessing.Lock())
+    lat = []
+    for _ in range(5 if quick else 20):
+        m.rotate(1)
+        m.wait()
+        woke = time.perf_counter_ns()
+        last = _drain(q)[-1][0]
+        lat.append(woke - last)
+    m.worker.terminate()
+    # a negative latency means wait() returned before the move had finished
+    res = _summary([x for x in lat if x >= 0])
+    res["early_returns"] = sum(x < 0 for x in lat)
+    return res
+
+
+def bench_enqueue(quick):
+    st = _stepper_module()
+    s = Shifter(DATA, CLOCK, LATCH, backend=HC595Chain(DATA, CLOCK, LATCH, keep=False))
+    m = st.Stepper(s, multiprocessing.Lock(), coalesce=True)
+    q = multiprocessing.Queue()
+    n = 200 if quick else 2000
+    ring, mpq = [], []
+    for k in range(n):
+        t0 = time.perf_counter_ns()
+        m.goAngle(k % 2)        # coalescing keeps the worker from falling behind
+        ring.append(time.perf_counter_ns() - t0)
+        t0 = time.perf_counter_ns()
+        q.put(("abs", float(k % 2), None, k))
+        mpq.append(time.perf_counter_ns() - t0)
+    m.wait(5)
+    m.worker.terminate()
+    return {"ring": _summary(ring), "queue": _summary(mpq)}
+
+
+def _serve(modname, port):
+    mod = importlib.import_module(modname)
+    mod.pwms[:] = [MemoryPWM(p, mod.FREQ) for p in mod.PINS]
+    sys.stdout = open("/dev/null", "w")
+    mod.run("127.0.0.1", port)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# One request per connection, sent in a single write: the lab servers read
+# the request with a single recv(), so a body sent separately would be lost
+def _http_request(port, method, path, body=""):
+    req = (f"{method} {path} HTTP/1.1\r\nHost: 127.0.0.1\r\n"
+           f"Content-Type: application/x-www-form-urlencoded\r\n"
+           f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n{body}").encode()
+    with socket.create_connection(("127.0.0.1", port), timeout=5) as c:
+        c.sendall(req)
+        resp = b""
+        while True:
+            chunk = c.recv(65536)
+            if not chunk:
+                break
+            resp += chunk
+    if not resp.startswith(b"HTTP/1.1 200"):
+        raise RuntimeError(f"{method} {path}: {resp[:40]!r}")
+
+
+def bench_http(quick):
+    n = 100 if quick else 1000
+    res = {}
+    for modname, path in (("lab7_problem1", "/"), ("lab7_problem2", "/set")):
+        port = _free_port()
+        proc = multiprocessing.Process(target=_serve, args=(modname, port), daemon=True)
+        proc.start()
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                _http_request(port, "GET", "/")    # a bare connect would crash the server
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.01)
+        lat = {"GET": [], "POST": []}
+        t0 = time.perf_counter_ns()
+        for i in range(n):
+            t = time.perf_counter_ns()
+            if i % 2:
+                method = "GET"
+                _http_request(port, method, "/")
+            else:
+                method = "POST"
+                _http_request(port, method, path, f"led={i % 3}&level={i % 101}")
+            lat[method].append(time.perf_counter_ns() - t)
+        dt = time.perf_counter_ns() - t0
+        proc.terminate()
+        proc.join()
+        res[modname] = {"requests": n, "requests_per_s": n * 1e9 / dt,
+                        "GET": _summary(lat["GET"]), "POST": _summary(lat["POST"])}
+    return res
+
+
+BENCHES = {"shift": bench_shift, "stepper": bench_stepper, "sync": bench_sync,
+           "scheduler": bench_scheduler, "wait": bench_wait, "enqueue": bench_enqueue,
+           "http": bench_http}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m bench")
+    ap.add_argument("names", nargs="*", metavar="name",
+                    help="benchmarks to run (default: all of %s)" % ", ".join(BENCHES))
+    ap.add_argument("--out", default="bench_results.json", help="JSON results file")
+    ap.add_argument("--quick", action="store_true", help="shorter runs")
+    args = ap.parse_args(argv)
+    for name in args.names:
+        if name not in BENCHES:
+            ap.error(f"unknown benchmark {name!r}")
+
+    results = {"meta": {"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "python": platform.python_version(),
+                        "machine": platform.machine(), "node": platform.node(),
+                        "quick": args.quick}}
+    for name in args.names or BENCHES:
+        print(f"{name} ...", flush=True)
+        results[name] = BENCHES[name](args.quick)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps({k: v for k, v in results.items() if k != "meta"}, indent=2))
+    print(f"wrote {args.out}")
+
+
+if __name__ == "__main__":
+    main()
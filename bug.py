@@ -1,16 +1,29 @@
 import time
+import queue
 import random
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:     # off the Pi; pass a Shifter on hc595_sim.HC595Chain
+    GPIO = None
 from shifter import Shifter
+from precise_timing import DeadlineTimer
+from timer_wheel import TimerWheel
 
+# Call update() from a polling loop, or pass a timer_wheel.TimerWheel and
+# the bug schedules its own steps on it (many bugs can share one wheel)
 class Bug:
-    def __init__(self, timestep=0.1, x=3, isWrapOn=False):
+    def __init__(self, timestep=0.1, x=3, isWrapOn=False, shifter=None, wheel=None):
         self.timestep = float(timestep)
         self.x = int(x)
         self.isWrapOn = bool(isWrapOn)
-        self.__shifter = Shifter(dataPin=23, latchPin=24, clockPin=25)
+        if shifter is None:
+            shifter = Shifter(data=23, latch=24, clock=25)
+        self.__shifter = shifter
         self._running = False
-        self._next_step_at = time.time()
+        self._timer = DeadlineTimer()   # steps are due every timestep from start()
+        self._wheel = wheel
+        self._pending = None            # next step on the wheel
+        self._next_ns = 0               # when it is due (time.monotonic_ns)
         self._show()
 
     def _show(self): # show one LED
@@ -29,19 +42,39 @@ class Bug:
 
     def start(self):
         self._running = True
-        self._next_step_at = time.time() + self.timestep
+        self._timer.start()
+        if self._wheel is not None:
+            if self._pending is not None:
+                self._wheel.cancel(self._pending)
+            self._next_ns = time.monotonic_ns()
+            self._schedule()
 
     def stop(self):
         self._running = False
+        if self._pending is not None:
+            self._wheel.cancel(self._pending)
+            self._pending = None
         self.__shifter.clear()
 
+    # Put the next step on the wheel, timestep after the last one was due
+    # (a bug a whole step behind starts counting again from now)
+    def _schedule(self):
+        now = time.monotonic_ns()
+        period = int(self.timestep * 1e9)
+        self._next_ns += period
+        if self._next_ns < now - period:
+            self._next_ns = now
+        self._pending = self._wheel.call_at(self._next_ns, self._on_timer)
+
+    def _on_timer(self):
+        self._step_once()
+        self._schedule()
+
     def update(self):
         if not self._running:
             return
-        now = time.time()
-        if now >= self._next_step_at:
+        if self._timer.due(self.timestep):
             self._step_once()
-            self._next_step_at = now + self.timestep
 
 
 if __name__ == "__main__":
@@ -52,41 +85,54 @@ if __name__ == "__main__":
     for s in (s1, s2, s3):
         GPIO.setup(s, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
 
-    bug = Bug(timestep=0.1, x=3, isWrapOn=False)
-    prev_s1 = GPIO.input(s1)
-    prev_s2 = GPIO.input(s2)
-    prev_s3 = GPIO.input(s3)
+    # Switch edges arrive from the RPi.GPIO event thread; the loop sleeps
+    # until one does or the bug is due to step, so it uses no CPU when idle.
+    # bouncetime debounces the switches instead of sleeping after a toggle.
+    events = queue.Queue()
+    def on_edge(pin):
+        events.put(pin)
+    for s in (s1, s2, s3):
+        GPIO.add_event_detect(s, GPIO.BOTH, callback=on_edge, bouncetime=150)
+
+    wheel = TimerWheel(tick=0.001)
+    bug = Bug(timestep=0.1, x=3, isWrapOn=False, wheel=wheel)
+
+    # s1 turns bug on/off.  Start/stop follows s1's actual level, read on
+    # every wake, rather than an edge: bouncetime drops an edge that comes
+    # within 150 ms of the last one, and a sample taken in the callback
+    # can catch a bounce.  After each s1 edge the level is checked again
+    # once it has settled, so a dropped release still stops the bug.
+    def follow_s1():
+        if GPIO.input(s1):
+            if not bug._running:
+                bug.start()
+        elif bug._running:
+            bug.stop()
 
     print("Lab 6 running. s1=ON/OFF, s2=wrap, s3=3x speed. CTRL+C to exit.")
 
     try:
         while True:
-            cur_s1 = GPIO.input(s1)
-            cur_s2 = GPIO.input(s2)
-            cur_s3 = GPIO.input(s3)
+            try:
+                pin = events.get(timeout=wheel.timeout())
+            except queue.Empty:
+                pin = None
 
-            # s1 turns bug on/off
-            if cur_s1 and not prev_s1:
-                bug.start()
-            elif (not cur_s1) and prev_s1:
-                bug.stop()
+            if pin == s1:
+                wheel.call_later(0.2, follow_s1)
 
             # s2 toggles wrapping
-            if cur_s2 != prev_s2:
+            elif pin == s2:
                 bug.isWrapOn = not bug.isWrapOn
                 print("wrap =", bug.isWrapOn)
-                time.sleep(0.15)
 
             # s3 speeds up
-            if cur_s3 != prev_s3:
+            elif pin == s3:
                 bug.timestep = max(0.01, bug.timestep / 3.0)
                 print("timestep =", bug.timestep)
-                time.sleep(0.15)
-
-            prev_s1, prev_s2, prev_s3 = cur_s1, cur_s2, cur_s3
 
-            bug.update()
-            time.sleep(0.005)
+            follow_s1()
+            wheel.advance()
 
     except KeyboardInterrupt:
         print("\nExiting. Cleaning up GPIO...")
@@ -0,0 +1,216 @@
+# Shared-memory command ring
+#
+# Single-producer/single-consumer ring of fixed-size command records in one
+# multiprocessing.shared_memory block, used in place of a
+# multiprocessing.Queue between a caller and its motor worker.  A push is a
+# few stores into shared memory, with no pickling, feeder thread or pipe,
+# so it takes microseconds:
+#
+#   ring = CommandRing(64)          # before forking the consumer
+#   ring.push(REL, 90.0, seq)       # producer
+#   cmd, val, seq = ring.get()      # consumer, blocks while empty
+#   ring.peek(8)                    # consumer, the next records left in place
+#
+# Layout (int64 words): head, tail, consumer sleeping, producer sleeping,
+# then capacity slots of [gen, cmd, val (float64), seq].  Only the producer
+# writes head and the slots, only the consumer writes tail, and aligned
+# 8-byte stores are not torn (as in motor_state).  A slot is written as
+# gen = -1, the record, then gen = its absolute index; seq must grow from
+# one push to the next.
+#
+# Memory ordering: Python has no fences, so the ring only assumes that each
+# side's stores reach the other side eventually, not in program order.
+#   - A slot whose gen (or seq) does not match yet is read again, never
+#     dropped: on ARM the slot stores may show up after head.  A record is
+#     only skipped once head - tail is past capacity, i.e. push(overwrite=
+#     True) really replaced it (the consumer then moves on, as if the
+#     oldest command had been dropped).
+#   - A side that has to wait sets its sleep flag, checks the other side's
+#     index again and sleeps on an eventfd (a pipe where os.eventfd is
+#     missing); the other side only makes the wake-up syscall when the flag
+#     is set.  Store->load reordering (even x86 allows it) can lose that
+#     wake-up, so every sleep is bounded by NAP and the check repeated: a
+#     lost wake-up costs at most NAP, and an idle consumer wakes 1/NAP
+#     times a second.
+
+import os
+import select
+import time
+from multiprocessing import shared_memory
+
+REL, ABS, EXT, ZERO = 0, 1, 2, 3   # record kinds; EXT = the message went by another channel
+
+_HEAD, _TAIL, _CSLEEP, _PSLEEP = range(4)
+_HDR = 4                    # header words
+_SLOT = 4                   # words per slot: gen, cmd, val, seq
+NAP = 0.01                  # longest sleep before a side looks again [s]
+
+
+# Counting wake-up fd: eventfd on Linux, else a non-blocking pipe
+class _Wakeup:
+    def __init__(self):
+        if hasattr(os, "eventfd"):
+            self.r = self.w = os.eventfd(0, os.EFD_NONBLOCK)
+        else:
+            self.r, self.w = os.pipe()
+            os.set_blocking(self.r, False)
+            os.set_blocking(self.w, False)
+
+    def set(self):
+        try:
+            if hasattr(os, "eventfd"):
+                os.eventfd_write(self.w, 1)
+            else:
+                os.write(self.w, b"\x01")
+        except BlockingIOError:     # already pending
+            pass
+
+    # Block until set() (or timeout [s]), then clear
+    def wait(self, timeout=None):
+        select.select([self.r], [], [], timeout)
+        try:
+            os.read(self.r, 8 if self.r == self.w else 4096)
+        except BlockingIOError:
+            pass
+
+    def close(self):
+        os.close(self.r)
+        if self.w != self.r:
+            os.close(self.w)
+
+
+class CommandRing:
+    def __init__(self, capacity=64):
+        if capacity < 1:
+            raise ValueError("capacity must be at least 1")
+        self.capacity = capacity
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * (_HDR + _SLOT*capacity))
+        self.q = self.shm.buf.cast('q')     # header and slot words
+        self.d = self.shm.buf.cast('d')     # the same words as float64, for val
+        for k in range(len(self.q)):
+            self.q[k] = 0
+        for k in range(capacity):
+            self.q[_HDR + _SLOT*k] = -1     # no record yet
+        self._data = _Wakeup()              # producer -> sleeping consumer
+        self._space = _Wakeup()             # consumer -> sleeping producer
+        self._last_seq = None               # consumer: seq of the last record popped
+
+    def __len__(self):
+        return max(0, min(self.capacity, self.q[_HEAD] - self.q[_TAIL]))
+
+    def full(self) -> bool:
+        return self.q[_HEAD] - self.q[_TAIL] >= self.capacity
+
+    # ---- producer ----
+
+    # Append a record.  Returns False if the ring is full, unless overwrite
+    # is set: then the oldest unread record is replaced.
+    def push(self, cmd, val, seq, overwrite=False) -> bool:
+        q = self.q
+        head = q[_HEAD]
+        if not overwrite and head - q[_TAIL] >= self.capacity:
+            return False
+        s = _HDR + _SLOT * (head % self.capacity)
+        q[s] = -1                   # the consumer skips a slot being written
+        q[s+1] = cmd
+        self.d[s+2] = val
+        q[s+3] = seq
+        q[s] = head
+        q[_HEAD] = head + 1
+        if q[_CSLEEP]:
+            self._data.set()
+        return True
+
+    # seq of the record push(overwrite=True) would replace, or None if the
+    # ring has room
+    def oldest(self):
+        q = self.q
+        head = q[_HEAD]
+        if head - q[_TAIL] < self.capacity:
+            return None
+        return q[_HDR + _SLOT * (head % self.capacity) + 3]
+
+    # Block until the ring has room (or timeout [s]); False on timeout
+    def wait_space(self, timeout=None) -> bool:
+        q = self.q
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.full():
+            nap = NAP
+            if deadline is not None:
+                nap = min(nap, deadline - time.monotonic())
+                if nap <= 0:
+                    return False
+            q[_PSLEEP] = 1
+            if self.full():         # the consumer may have popped before it saw the flag
+                self._space.wait(nap)
+            q[_PSLEEP] = 0
+        return True
+
+    # ---- consumer ----
+
+    # Oldest record as (cmd, val, seq), or None if the ring is empty
+    def pop(self):
+        q, cap = self.q, self.capacity
+        tries = 0
+        while True:
+            tail, head = q[_TAIL], q[_HEAD]
+            if tail >= head:
+                return None
+            if head - tail > cap:   # the producer lapped us: those records are gone
+                tail = head - cap
+            s = _HDR + _SLOT * (tail % cap)
+            gen = q[s]
+            rec = (q[s+1], self.d[s+2], q[s+3])
+            if (gen == tail and q[s] == tail
+                    and (self._last_seq is None or rec[2] > self._last_seq)):
+                q[_TAIL] = tail + 1
+                self._last_seq = rec[2]
+                if q[_PSLEEP]:
+                    self._space.set()
+                return rec
+            if q[_HEAD] - tail > cap:   # overwritten while we read it: skip it
+                q[_TAIL] = tail + 1
+                continue
+            # its stores are not visible yet (or it is mid-write): look again
+            tries += 1
+            if tries % 64 == 0:
+                os.sched_yield()
+
+    # Up to n unread records, oldest first, without taking them off the
+    # ring (they still count against its capacity).  Stops at a slot whose
+    # stores are not visible yet.
+    def peek(self, n) -> list:
+        q, cap = self.q, self.capacity
+        tail, head = q[_TAIL], q[_HEAD]
+        tail = max(tail, head - cap)
+        last = self._last_seq
+        out = []
+        for k in range(tail, min(head, tail + n)):
+            s = _HDR + _SLOT * (k % cap)
+            gen = q[s]
+            rec = (q[s+1], self.d[s+2], q[s+3])
+            if gen != k or q[s] != k or (last is not None and rec[2] <= last):
+                break
+            out.append(rec)
+            last = rec[2]
+        return out
+
+    # Oldest record, blocking while the ring is empty
+    def get(self):
+        q = self.q
+        while True:
+            rec = self.pop()
+            if rec is not None:
+                return rec
+            q[_CSLEEP] = 1
+            if q[_HEAD] <= q[_TAIL]:    # the producer may have pushed before it saw the flag
+                self._data.wait(NAP)
+            q[_CSLEEP] = 0
+
+    def close(self):
+        self.q.release()
+        self.d.release()
+        self.shm.close()
+        self.shm.unlink()
+        self._data.close()
+        self._space.close()
@@ -0,0 +1,70 @@
+# Stepper drive modes
+#
+# Every mode walks the same 8-entry half-step coil table, and positions are
+# always counted in half-steps, so a motor can change mode between moves
+# without losing its place:
+#
+#   half   every entry, one half-step per frame (finest positioning)
+#   full   the two-coil entries, two half-steps per frame (most torque)
+#   wave   the single-coil entries, two half-steps per frame (least current)
+#
+# full and wave move twice as far per frame, so a long slew needs half the
+# frames.  When the coils sit on an entry the mode does not use (after a
+# half-step move), or a move has an odd number of half-steps left, that
+# frame is a single half-step.
+#
+# Each mode's next-entry tables are built once; plan() turns a move into
+# the coil entry of every frame.
+
+HALF_SEQ = (0b0001,0b0011,0b0010,0b0110,0b0100,0b1100,0b1000,0b1001) # CCW sequence
+
+
+class DriveMode:
+    def __init__(self, name, stride, parity):
+        self.name = name
+        self.stride = stride        # half-steps per frame
+        self.parity = parity        # table entries used (index % 2), None = all
+        # next entry from each entry, forward and reverse: (entry, half-steps)
+        self.next = {d: tuple(self._next(p, d) for p in range(8)) for d in (1, -1)}
+
+    def _next(self, p, d):
+        if self.stride == 1 or p % 2 != self.parity:
+            return (p + d) % 8, 1
+        return (p + 2*d) % 8, 2
+
+    # number of frames to move n half-steps from entry p
+    def frames(self, p, n) -> int:
+        if self.stride == 1 or n == 0:
+            return n
+        align = 1 if p % 2 != self.parity else 0
+        return align + -(-(n - align) // 2)
+
+    # coil table entries of the frames that move n half-steps in direction d
+    def plan(self, p, d, n) -> list:
+        nxt = self.next[d]
+        out = []
+        while n > 0:
+            q, k = nxt[p]
+            if k > n:               # one half-step left
+                q, k = (p + d) % 8, 1
+            out.append(q)
+            p, n = q, n - k
+        return out
+
+    def __repr__(self):
+        return f"DriveMode({self.name!r})"
+
+
+MODES = {m.name: m for m in (DriveMode("half", 1, None),
+                             DriveMode("full", 2, 1),
+                             DriveMode("wave", 2, 0))}
+MODE_NAMES = tuple(MODES)           # mode number (as kept in motor_state) -> name
+
+
+def get_mode(mode) -> DriveMode:
+    if isinstance(mode, DriveMode):
+        return mode
+    try:
+        return MODES[mode]
+    except KeyError:
+        raise ValueError(f"drive mode must be one of {MODE_NAMES}") from None
@@ -5,11 +5,16 @@
 # Because only one motor action is allowed at a time, multithreading could be
 # used instead of multiprocessing. However, the GIL makes the motor process run 
 # too slowly on the Pi Zero, so multiprocessing is needed.
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:     # off the Pi; pass a Shifter on hc595_sim.HC595Chain
+    GPIO = None
 import time
 import multiprocessing
 import math
 from shifter import Shifter   # our custom Shifter class
+from motion_handles import MoveHandle
+from precise_timing import DeadlineTimer, sleep_until
 
 # signed shortest delta in (−180, 180]
 def _shortest_delta(current_deg: float, target_deg: float) -> float:
@@ -52,6 +57,9 @@ class Stepper:
         self.shifter_bit_start = 4*Stepper.num_steppers  # starting bit position
         self.lock = lock           # multiprocessing lock
         self.busy = multiprocessing.Value('b', False)       # True while stepping
+        self.done = multiprocessing.Condition()             # notified when a command finishes
+        self.finished = multiprocessing.Value('q', 0)       # commands finished (worker side)
+        self._issued = 0                                    # commands sent (caller side)
         
         Stepper.num_steppers += 1   # increment the instance count
 
@@ -88,39 +96,25 @@ class Stepper:
         with self.lock:
             numSteps = int(Stepper.steps_per_degree * abs(delta))
             dir = self.__sgn(delta)
+            timer = DeadlineTimer()
             for _ in range(numSteps):
                 self.__step(dir)
-                time.sleep(Stepper.delay/1e6)
+                timer.wait(Stepper.delay/1e6)
         with self.busy.get_lock():
             self.busy.value = False
 
-    def wait(self, dwell_s=0.0):
-        started = False
-        while True:
-            # If nothing has started AND nothing is queued AND not busy -> nothing to wait for
-            if not started and self.queue.empty():
-                with self.busy.get_lock():
-                    if not self.busy.value:
-                        break
-
-            with self.busy.get_lock():
-                b = self.busy.value
-
-            if b:
-                started = True                  # we saw motion start
-
-            if started and not b:
-                break                           # motion finished
-
-            time.sleep(0.001)                   # fast, smooth poll
-        """
-        # optional short, reliable dwell at the target (sub-10 ms accurate)
+    # Block until every command sent so far has finished (woken by the
+    # worker, so a move still sitting in the queue is waited for too)
+    def wait(self, dwell_s=0.0, timeout=None):
+        if not self.__handle(self._issued).wait(timeout):
+            return False
+        # optional short, reliable dwell at the target
         if dwell_s > 0.0:
-            end = time.perf_counter() + float(dwell_s)
-            while time.perf_counter() < end:
-                pass
-        """
+            sleep_until(time.perf_counter_ns() + int(dwell_s * 1e9))
+        return True
 
+    def __handle(self, seq):
+        return MoveHandle(self.done, lambda: self.finished.value, seq)
 
     def __worker_loop(self):
         while True:
@@ -132,14 +126,21 @@ class Stepper:
                     current = self.angle.value
                 delta = _shortest_delta(current, val)
                 self.__rotate(delta)
+            with self.done:
+                self.finished.value += 1
+                self.done.notify_all()
 
             
     # Move relative angle from current position:
     def rotate(self, delta):
+        self._issued += 1
         self.queue.put(("rel", float(delta)))          # queue relative move
+        return self.__handle(self._issued)
 
     def goAngle(self, target_angle):
+        self._issued += 1
         self.queue.put(("abs", float(target_angle)))   # queue absolute target
+        return self.__handle(self._issued)
 
 
     # Set the motor zero point
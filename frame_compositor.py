@@ -0,0 +1,129 @@
+# Frame compositor
+#
+# One writer process owns the Shifter.  Each motor publishes its coil
+# nibble into its own slot of a shared array and drops a byte into a pipe
+# to wake the writer; no lock is taken on the step path.  The writer merges
+# all slots into one chain word and latches it on the next tick boundary,
+# so motors stepping within the same tick share a single shift.
+#
+#   comp = FrameCompositor(s)
+#   Stepper.compositor = comp       # before creating the Steppers
+#   m1 = Stepper(s, lock1); m2 = Stepper(s, lock2)
+#   comp.start()
+#   ...
+#   comp.stop()
+#
+# Slot i drives chain bits 4i..4i+3, the same layout as Stepper.  A slot
+# is a single aligned 8-byte store, so the writer never sees half of one.
+# Steps are delayed by up to one tick; a larger tick_us merges more steps
+# per frame.
+#
+# publish() numbers each motor's nibbles and the writer records, per slot,
+# the number of the last one it latched.  A motor waits for its nibble to
+# be latched (wait_latched) before it counts the step or publishes the
+# next one, so no coil phase is ever skipped: a writer that falls behind
+# slows the motors down rather than losing their steps.  To keep up it
+# needs a core (or priority): rt (an rt_config.RTConfig) gives it one, and
+# rt_report() says what it got.
+
+import multiprocessing
+import os
+import time
+
+from precise_timing import sleep_until
+from rt_config import RTReport
+
+MAX_SLOTS = 16      # 64-bit chain word
+
+
+class FrameCompositor:
+    def __init__(self, shifter, tick_us=100, rt=None):
+        self.s = shifter
+        self.tick_ns = int(tick_us * 1000)
+        self.rt = rt                                           # real-time settings of the writer
+        self._rt_report = RTReport()
+        self.slots = multiprocessing.RawArray('q', MAX_SLOTS)  # nibble of each motor
+        self.published = multiprocessing.RawArray('q', MAX_SLOTS)  # nibbles published per slot
+        self.latched = multiprocessing.RawArray('q', MAX_SLOTS)    # of those, on the outputs
+        self.chain_bits = multiprocessing.RawValue('i', 8)     # grown by register()
+        self._r, self._w = os.pipe()                           # wake-ups for the writer
+        os.set_blocking(self._w, False)                        # a publish never waits
+        self.process = None
+
+    # Claim slot i, growing the chain to whole registers
+    def register(self, i):
+        if not 0 <= i < MAX_SLOTS:
+            raise ValueError(f"the compositor only has {MAX_SLOTS} slots")
+        self.chain_bits.value = max(self.chain_bits.value, -(-4*(i+1) // 8) * 8)
+
+    # Called by a motor (any process): store its nibble and wake the
+    # writer.  Returns the nibble's number for wait_latched().
+    def publish(self, i, nibble) -> int:
+        n = self.published[i] + 1   # only motor i writes slot i
+        self.slots[i] = nibble
+        self.published[i] = n
+        try:
+            os.write(self._w, b"\x01")
+        except BlockingIOError:     # pipe full: the writer has plenty of wake-ups
+            pass
+        return n
+
+    # Block until slot i's nibble number n is on the outputs
+    def wait_latched(self, i, n):
+        while self.latched[i] < n:
+            time.sleep(self.tick_ns / 4e9)
+
+    def start(self):
+        self.process = multiprocessing.Process(target=self._run, daemon=True)
+        self.process.start()
+
+    # Affinity, policy, priority and memory locking the writer ended up
+    # with, or None if it has not started within timeout
+    def rt_report(self, timeout=1.0):
+        return self._rt_report.get(timeout)
+
+    def stop(self):
+        if self.process is not None:
+            while True:
+                try:
+                    os.write(self._w, b"\x00")
+                    break
+                except BlockingIOError:
+                    time.sleep(0.001)
+            self.process.join()
+            self.process = None
+
+    # ---- everything below runs in the writer process ----
+
+    def _drain(self) -> bytes:
+        os.set_blocking(self._r, False)
+        try:
+            return os.read(self._r, 4096)
+        except BlockingIOError:
+            return b""
+        finally:
+            os.set_blocking(self._r, True)
+
+    def _compose(self) -> int:
+        word = 0
+        for i, nibble in enumerate(self.slots):
+            word |= nibble << 4*i
+        return word
+
+    def _run(self):
+        self._rt_report.apply(self.rt)
+        last = None
+        while True:
+            wake = os.read(self._r, 4096)       # block until a motor publishes
+            # latch on the next tick boundary; every step published before
+            # then goes into the same frame
+            sleep_until((time.perf_counter_ns() // self.tick_ns + 1) * self.tick_ns)
+            wake += self._drain()
+            counts = self.published[:]      # before the slots, so no count runs ahead of its nibble
+            word = self._compose()
+            if word != last:
+                self.s.shiftWord(word, self.chain_bits.value)
+                last = word
+            self.latched[:] = counts
+            if b"\x00" in wake:
+                return
@@ -0,0 +1,181 @@
+# GPIO backends for the Shifter class
+#
+# A backend drives BCM-numbered output pins.  Pins are passed to the bulk
+# calls as bit masks (1 << pin) so that a backend which can write several
+# pins at once (the memory-mapped one) does it with a single word store:
+#
+#   setup(pin)          configure pin as an output, driven low
+#   output(pin, level)  drive one pin
+#   set_bits(mask)      drive every pin in mask high
+#   clear_bits(mask)    drive every pin in mask low
+#   cleanup()           release the hardware
+#
+# and optionally
+#
+#   pin_ops(pin)        (low, high): zero-argument callables that drive one
+#                       pin, resolved once so a bit-banging loop calls
+#                       straight into the library or register store
+#
+# pin_ops(backend, pin) below falls back to set_bits/clear_bits for
+# backends that do not have it.
+
+import mmap
+import os
+from functools import partial
+
+
+# mask -> tuple of pin numbers
+def _mask_pins(mask: int) -> tuple:
+    return tuple(p for p in range(mask.bit_length()) if mask >> p & 1)
+
+
+# (low, high) writers of one pin on any backend
+def pin_ops(backend, pin) -> tuple:
+    ops = getattr(backend, "pin_ops", None)
+    if ops is not None:
+        return ops(pin)
+    return partial(backend.clear_bits, 1 << pin), partial(backend.set_bits, 1 << pin)
+
+
+# The course RPi.GPIO library (one Python -> C call per pin write)
+class RPiGPIOBackend:
+    def __init__(self):
+        from RPi import GPIO
+        GPIO.setmode(GPIO.BCM)
+        self.GPIO = GPIO
+        self._pins = {}     # mask -> pin tuple cache
+
+    def setup(self, pin):
+        self.GPIO.setup(pin, self.GPIO.OUT, initial=0)
+
+    def output(self, pin, level):
+        self.GPIO.output(pin, level)
+
+    # scalar-pin GPIO.output calls, no mask lookup or tuple channel
+    def pin_ops(self, pin):
+        return partial(self.GPIO.output, pin, 0), partial(self.GPIO.output, pin, 1)
+
+    def _lookup(self, mask):
+        pins = self._pins.get(mask)
+        if pins is None:
+            pins = self._pins[mask] = _mask_pins(mask)
+        return pins
+
+    def set_bits(self, mask):
+        self.GPIO.output(self._lookup(mask), 1)
+
+    def clear_bits(self, mask):
+        self.GPIO.output(self._lookup(mask), 0)
+
+    def cleanup(self):
+        self.GPIO.cleanup()
+
+
+# Direct access to the BCM283x GPIO block through /dev/gpiomem.  Every pin
+# write is one 32-bit store into the GPSET0 or GPCLR0 register.  Any regular
+# file can stand in for /dev/gpiomem so the register traffic can be checked
+# off the Pi.
+class MmapGPIOBackend:
+    GPFSEL0 = 0x00      # function select, 3 bits per pin, 10 pins per word
+    GPSET0  = 0x1C      # write 1s to drive pins 0-31 high
+    GPCLR0  = 0x28      # write 1s to drive pins 0-31 low
+    BLOCK_SIZE = 4096
+
+    def __init__(self, path="/dev/gpiomem"):
+        fd = os.open(path, os.O_RDWR | os.O_SYNC)
+        try:
+            if os.path.isfile(path) and os.fstat(fd).st_size < self.BLOCK_SIZE:
+                os.ftruncate(fd, self.BLOCK_SIZE)   # plain-file stand-in
+            self._mem = mmap.mmap(fd, self.BLOCK_SIZE, mmap.MAP_SHARED,
+                                  mmap.PROT_READ | mmap.PROT_WRITE)
+        finally:
+            os.close(fd)
+        self.regs = memoryview(self._mem).cast('I')     # 32-bit register view
+        self._set = self.GPSET0 // 4
+        self._clr = self.GPCLR0 // 4
+
+    def setup(self, pin):
+        if not 0 <= pin < 32:
+            raise ValueError(f"pin {pin} is outside GPIO bank 0")
+        reg = self.GPFSEL0 // 4 + pin // 10
+        shift = (pin % 10) * 3
+        self.regs[reg] = (self.regs[reg] & ~(0b111 << shift)) | (0b001 << shift)
+        self.regs[self._clr] = 1 << pin
+
+    def output(self, pin, level):
+        self.regs[self._set if level else self._clr] = 1 << pin
+
+    def pin_ops(self, pin):
+        store = self.regs.__setitem__
+        return partial(store, self._clr, 1 << pin), partial(store, self._set, 1 << pin)
+
+    def set_bits(self, mask):
+        self.regs[self._set] = mask
+
+    def clear_bits(self, mask):
+        self.regs[self._clr] = mask
+
+    def cleanup(self):
+        self.regs.release()
+        self._mem.close()
+
+
+# Pure in-memory pins for tests.  levels is a bit mask of the pins that are
+# high, writes counts every pin-write call and log (if enabled) keeps
+# (mask, level) for each one.
+class MemoryGPIOBackend:
+    def __init__(self, record=False):
+        self.levels = 0
+        self.outputs = 0    # mask of pins set up as outputs
+        self.writes = 0
+        self.log = [] if record else None
+
+    def setup(self, pin):
+        self.outputs |= 1 << pin
+        self.levels &= ~(1 << pin)
+
+    def output(self, pin, level):
+        if level:
+            self.set_bits(1 << pin)
+        else:
+            self.clear_bits(1 << pin)
+
+    def set_bits(self, mask):
+        self.levels |= mask
+        self.writes += 1
+        if self.log is not None:
+            self.log.append((mask, 1))
+
+    def clear_bits(self, mask):
+        self.levels &= ~mask
+        self.writes += 1
+        if self.log is not None:
+            self.log.append((mask, 0))
+
+    def level(self, pin) -> int:
+        return self.levels >> pin & 1
+
+    def cleanup(self):
+        self.levels = 0
+
+
+# In-memory stand-in for an RPi.GPIO PWM channel
+class MemoryPWM:
+    def __init__(self, pin=None, freq=0):
+        self.pin, self.freq = pin, freq
+        self.duty = 0
+        self.running = False
+        self.changes = 0
+
+    def start(self, duty):
+        self.duty, self.running = duty, True
+
+    def ChangeDutyCycle(self, duty):
+        self.duty = duty
+        self.changes += 1
+
+    def ChangeFrequency(self, freq):
+        self.freq = freq
+
+    def stop(self):
+        self.running = False
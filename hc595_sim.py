@@ -0,0 +1,117 @@
+# Simulated 74HC595 chain, usable as a Shifter backend
+#
+# Models the three stages of a daisy-chained 74HC595: the serial input (SER),
+# the shift stage (clocked on the rising SRCLK edge) and the storage latch
+# (copied on the rising RCLK edge).  Every latch is recorded with a
+# perf_counter_ns timestamp, and the pin traffic that produced it is
+# counted, so Stepper, SyncController and Bug can run without a Pi:
+#
+#   chain = HC595Chain(data=16, clock=21, latch=20, num_registers=2)
+#   s = Shifter(data=16, clock=21, latch=20, backend=chain)
+#   s.shiftWord(0xBEEF, 16)
+#   chain.latched[-1]     -> (t_ns, 0xBEEF)
+#
+# Words read back in the Shifter frame layout: a frame shifted in with
+# shiftBytes(f) latches as int.from_bytes(f, "little").  Ordering mistakes
+# are collected in violations (or raised with strict=True):
+#
+#   - data changing in the same write as a rising clock edge (no setup time)
+#   - the latch rising while the clock is high, or in the same write as it
+#   - a latch after a number of clocks that is not a multiple of the chain
+#     width (the frame is misaligned in the chain)
+#
+# Counters and the latched list belong to the process that does the
+# shifting.  Forked Stepper workers can report latches back through
+# sink=some_multiprocessing_queue.put, which gets a (t_ns, word) tuple.
+
+from time import perf_counter_ns
+
+
+class TimingViolation(Exception):
+    pass
+
+
+class HC595Chain:
+    def __init__(self, data, clock, latch, num_registers=1, strict=False,
+                 sink=None, keep=True):
+        self.dataPin, self.clockPin, self.latchPin = data, clock, latch
+        self._data, self._clock, self._latch = 1 << data, 1 << clock, 1 << latch
+        self.width = 8 * int(num_registers)
+        self._top = self.width - 1
+        self.strict = strict
+        self.sink = sink
+        self.keep = keep            # False: don't grow self.latched (long runs)
+        self.levels = 0             # pin levels, bit per BCM pin
+        self.shift = 0              # shift stage
+        self.outputs = 0            # storage latch = what the outputs show
+        self.latched = []           # (t_ns, word) per latch
+        self.violations = []
+        self.reset_counters()
+
+    def reset_counters(self):
+        self.writes = 0             # backend calls
+        self.toggles = 0            # pin level changes
+        self.clocks = 0             # rising SRCLK edges
+        self.latches = 0            # rising RCLK edges
+        self._since_latch = 0
+
+    def _violation(self, msg):
+        if self.strict:
+            raise TimingViolation(msg)
+        self.violations.append((perf_counter_ns(), msg))
+
+    # apply one write; every pin in mask goes to level
+    def _write(self, mask, level):
+        old = self.levels
+        new = old | mask if level else old & ~mask
+        self.writes += 1
+        changed = old ^ new
+        if not changed:
+            return
+        self.toggles += bin(changed).count("1")
+        self.levels = new
+        rising = changed & new
+        if rising & self._clock:
+            if changed & self._data:
+                self._violation("data changed on the clock edge")
+            self.shift = (self.shift >> 1) | ((new >> self.dataPin & 1) << self._top)
+            self.clocks += 1
+            self._since_latch += 1
+        if rising & self._latch:
+            if (new & self._clock) or (changed & self._clock):
+                self._violation("latch raised before the clock returned low")
+            if self._since_latch % self.width:
+                self._violation(f"latched after {self._since_latch} clocks on a {self.width}-bit chain")
+            self._since_latch = 0
+            self.outputs = self.shift
+            self.latches += 1
+            t = perf_counter_ns()
+            if self.keep:
+                self.latched.append((t, self.outputs))
+            if self.sink is not None:
+                self.sink((t, self.outputs))
+
+    # backend interface (see gpio_backends.py)
+    def setup(self, pin):
+        self.levels &= ~(1 << pin)
+
+    def output(self, pin, level):
+        self._write(1 << pin, level)
+
+    def set_bits(self, mask):
+        self._write(mask, 1)
+
+    def clear_bits(self, mask):
+        self._write(mask, 0)
+
+    def cleanup(self):
+        self.levels = 0
+
+    # latched outputs in the Shifter frame layout
+    def frame(self) -> bytes:
+        return self.outputs.to_bytes(self.width // 8, "little")
+
+    # outputs of register r, counted from the Pi (0 = first in the chain),
+    # with Qa as bit 7 and Qh as bit 0
+    def register(self, r) -> int:
+        return self.frame()[self.width // 8 - 1 - r]
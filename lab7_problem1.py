@@ -1,14 +1,20 @@
-import socket, RPi.GPIO as GPIO
+import socket
+try:
+    import RPi.GPIO as GPIO
+except ImportError:     # off the Pi; fill pwms with gpio_backends.MemoryPWM
+    GPIO = None
 
 # GPIO/PWM
-GPIO.setwarnings(False); GPIO.setmode(GPIO.BCM)
 PINS = [12, 13, 18]
 FREQ = 500
 levels = [0, 0, 0]
 pwms = []
-for pin in PINS:
-    GPIO.setup(pin, GPIO.OUT)
-    p = GPIO.PWM(pin, FREQ); p.start(0); pwms.append(p)
+
+def setup_pwm():
+    GPIO.setwarnings(False); GPIO.setmode(GPIO.BCM)
+    for pin in PINS:
+        GPIO.setup(pin, GPIO.OUT)
+        p = GPIO.PWM(pin, FREQ); p.start(0); pwms.append(p)
 
 def set_level(i, v):
     v = max(0, min(100, int(v))); levels[i] = v; pwms[i].ChangeDutyCycle(v)
@@ -98,6 +104,7 @@ def run(host="", port=8080):
         s.close()
 
 if __name__ == "__main__":
+    setup_pwm()
     try:
         run("", 8080)
     except KeyboardInterrupt:
@@ -1,20 +1,24 @@
 import socket, json
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:     # off the Pi; fill pwms with gpio_backends.MemoryPWM
+    GPIO = None
 
 # GPIO/PWM
-GPIO.setwarnings(False)
-GPIO.setmode(GPIO.BCM)
-
 PINS = [12, 13, 18]
 FREQ = 500              # base PWM frequency
 levels = [0, 0, 0]      # duty cycles
 pwms = []
 
-for pin in PINS:
-    GPIO.setup(pin, GPIO.OUT)
-    p = GPIO.PWM(pin, FREQ)
-    p.start(0)
-    pwms.append(p)
+def setup_pwm():
+    """Start one PWM channel per LED pin"""
+    GPIO.setwarnings(False)
+    GPIO.setmode(GPIO.BCM)
+    for pin in PINS:
+        GPIO.setup(pin, GPIO.OUT)
+        p = GPIO.PWM(pin, FREQ)
+        p.start(0)
+        pwms.append(p)
 
 def set_level(i, v):
     """Update PWM duty cycle"""
@@ -175,6 +179,7 @@ def run(host="", port=8080):
 
 # Main Entry
 if __name__ == "__main__":
+    setup_pwm()
     try:
         run("", 8080)
     except KeyboardInterrupt:
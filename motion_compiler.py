@@ -0,0 +1,173 @@
+# Motion compiler
+#
+# Plans a whole motion for every motor ahead of time and renders it into
+# (timestamp, chain word) records.  Playing it back is one sleep_until()
+# and one shiftBytes() per frame: no per-step angle math, locks or queue
+# reads, so the same motion runs at much higher step rates than the
+# per-step Stepper workers allow.
+#
+#   mc = MotionCompiler(2)          # motor i on chain bits 4i..4i+3, like Stepper
+#   mc.goAngle(0, 90)
+#   mc.rotate(1, -45, profile=TrapezoidalProfile(2000, 8000))
+#   mc.sync()                       # later moves start once both have finished
+#   mc.goAngle(0, 0); mc.goAngle(1, 0)
+#   motion = mc.compile()
+#   motion.save("move.bin")         # optional; CompiledMotion.load() mmaps it
+#   play(s, motion)
+#
+# Each motor runs its moves back to back from t = 0; motors run at the same
+# time unless sync() lines them up.  Steps of different motors due within
+# tick_us of each other share one frame (a motor never steps twice in one).
+# Moves use the Stepper half-step sequence, its fixed 1200 us delay, or a
+# motion_profiles profile.
+
+import math
+import mmap
+import struct
+import time
+from array import array
+
+from shifter import word_to_frame
+from precise_timing import sleep_until, SPIN_NS, SLACK_NS
+
+SEQ = (0b0001,0b0011,0b0010,0b0110,0b0100,0b1100,0b1000,0b1001) # CCW sequence, as Stepper.seq
+DELAY_US = 1200                 # default delay between motor steps [us]
+STEPS_PER_DEGREE = 4096/360     # 4096 steps/rev * 1/360 rev/deg
+
+# file layout: header, then count int64 timestamps [ns], then count uint64 words
+_HEADER = struct.Struct("<4sIQ")    # magic, chain_bits, count
+_MAGIC = b"MOTN"
+
+
+# signed shortest delta in (−180, 180]
+def _shortest_delta(current_deg: float, target_deg: float) -> float:
+    return math.remainder(float(target_deg) - float(current_deg), 360.0)
+
+
+class CompiledMotion:
+    def __init__(self, times, words, chain_bits, positions=None):
+        self.times = times              # frame timestamps from the start [ns]
+        self.words = words              # chain word latched at each timestamp
+        self.chain_bits = chain_bits
+        self.positions = positions      # final step count of each motor (None when loaded)
+        self._mem = None
+
+    def __len__(self):
+        return len(self.times)
+
+    def duration(self) -> float:
+        return self.times[-1] / 1e9 if len(self.times) else 0.0
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, self.chain_bits, len(self.times)))
+            f.write(array('q', self.times).tobytes())
+            f.write(array('Q', self.words).tobytes())
+
+    # Map a saved motion without copying it; the records are read straight
+    # from the page cache
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            mem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, chain_bits, count = _HEADER.unpack_from(mem)
+        if magic != _MAGIC:
+            mem.close()
+            raise ValueError(f"{path} is not a compiled motion")
+        buf = memoryview(mem)
+        start = _HEADER.size
+        times = buf[start:start + 8*count].cast('q')
+        words = buf[start + 8*count:start + 16*count].cast('Q')
+        motion = cls(times, words, chain_bits)
+        motion._mem = (mem, buf)
+        return motion
+
+    def close(self):
+        if self._mem is not None:
+            mem, buf = self._mem
+            self.times.release()
+            self.words.release()
+            buf.release()
+            mem.close()
+            self._mem = None
+
+
+class MotionCompiler:
+    def __init__(self, num_motors, tick_us=100, phases=None):
+        self.num_motors = num_motors
+        self.chain_bits = max(8, -(-4*num_motors // 8) * 8)
+        self.tick_ns = int(tick_us * 1000)
+        self.pos = [0] * num_motors                         # step count of each motor
+        self.start_phase = list(phases) if phases else [0] * num_motors  # coil phase at t = 0
+        self.clock = [0] * num_motors                       # end of each motor's last move [ns]
+        self.events = []                                    # (t_ns, motor, dir)
+
+    # Move relative angle from the motor's planned position:
+    def rotate(self, motor, delta, profile=None):
+        n = int(STEPS_PER_DEGREE * abs(delta))
+        dir = 1 if delta > 0 else -1
+        if profile is not None:
+            intervals = profile.compile(n)
+        else:
+            intervals = [DELAY_US / 1e6] * n
+        t = self.clock[motor]
+        for k in range(n):      # step k fires at t, the wait after it is intervals[k]
+            self.events.append((t, motor, dir))
+            t += int(intervals[k] * 1e9)
+        self.clock[motor] = t
+        self.pos[motor] += dir * n
+
+    # Move to an absolute angle taking the shortest path:
+    def goAngle(self, motor, target_angle, profile=None):
+        current = (self.pos[motor] / STEPS_PER_DEGREE) % 360
+        self.rotate(motor, _shortest_delta(current, target_angle), profile)
+
+    # Hold a motor still for dwell_s
+    def pause(self, motor, dwell_s):
+        self.clock[motor] += int(dwell_s * 1e9)
+
+    # Start every later move no earlier than the end of all moves so far
+    def sync(self):
+        end = max(self.clock)
+        self.clock = [end] * self.num_motors
+
+    def compile(self) -> CompiledMotion:
+        times, words = array('q'), array('Q')
+        phase = list(self.start_phase)
+        word = 0
+        for i, p in enumerate(phase):
+            word |= SEQ[p] << 4*i
+        frame_t = None
+        stepped = 0         # mask of motors already in the open frame
+        for t, i, dir in sorted(self.events):
+            if frame_t is not None and (t >= frame_t + self.tick_ns or stepped >> i & 1):
+                times.append(frame_t)
+                words.append(word)
+                frame_t = None
+            if frame_t is None:
+                frame_t, stepped = t, 0
+            stepped |= 1 << i
+            phase[i] = (phase[i] + dir) % 8
+            word = (word & ~(0b1111 << 4*i)) | (SEQ[phase[i]] << 4*i)
+        if frame_t is not None:
+            times.append(frame_t)
+            words.append(word)
+        return CompiledMotion(times, words, self.chain_bits, list(self.pos))
+
+
+# Push a compiled motion to a Shifter (or SPIShifter) on its timestamps.
+# Frames are rendered to bytes before the first one is due.  Returns the
+# number of frames latched more than SLACK_NS late and the worst lateness.
+def play(shifter, motion, spin_ns=SPIN_NS):
+    frames = [word_to_frame(w, motion.chain_bits) for w in motion.words]
+    times = motion.times
+    overruns = worst = 0
+    t0 = time.perf_counter_ns()
+    for k in range(len(frames)):
+        late = sleep_until(t0 + times[k], spin_ns)
+        shifter.shiftBytes(frames[k])
+        if late > SLACK_NS:
+            overruns += 1
+            if late > worst:
+                worst = late
+    return {"frames": len(frames), "overruns": overruns, "worst_late_ns": worst}
@@ -0,0 +1,81 @@
+# Move completion handles
+#
+# rotate() and goAngle() return a MoveHandle for the command they queued.
+# Each motor numbers its commands 1, 2, 3, ... as they are sent, and its
+# worker publishes the number of the last command it finished and notifies a
+# multiprocessing Condition.  Commands finish in order, so a command is done
+# once that number has reached its own.  A waiter sleeps on the Condition
+# until then: no polling, and no window in which a queued move that has not
+# started yet looks finished.
+#
+#   h = m1.goAngle(90)
+#   h.wait(timeout=2.0)             # True once finished, False on timeout
+#   h.done()                        # non-blocking check
+#   wait_all([m1.goAngle(0), m2.goAngle(0)])
+#
+# A command the motor refused (a full queue with overflow="drop_newest")
+# gets a rejected handle: done() at once, and wait() returns False.
+#
+# A cancelled command is done too (like concurrent.futures), but cancelled()
+# is True and wait() returns False; so is one a full queue with
+# overflow="drop_oldest" discarded.  The engine records the number of every
+# command it cancels in a per-motor table of CANCEL_SLOTS entries (slot
+# seq % CANCEL_SLOTS), so the outcome of the last CANCEL_SLOTS commands is
+# known.
+
+import time
+
+CANCEL_SLOTS = 2048     # cancelled-command table per motor, more than a motor can have pending
+
+
+class MoveHandle:
+    def __init__(self, cond, finished, seq, was_cancelled=None):
+        self.cond = cond            # Condition notified whenever the motor finishes a command
+        self.finished = finished    # callable -> number of the motor's last finished command
+        self.seq = seq              # number of this command
+        self.was_cancelled = was_cancelled  # callable seq -> True if the engine cancelled it
+        self.rejected = False       # the motor never took the command
+
+    # Handle for a command the motor refused
+    @classmethod
+    def reject(cls):
+        h = cls(None, None, 0)
+        h.rejected = True
+        return h
+
+    # True once the motor is through with the command, finished or cancelled
+    def done(self) -> bool:
+        return self.rejected or self.finished() >= self.seq
+
+    # True if the command was cancelled before it finished
+    def cancelled(self) -> bool:
+        return (not self.rejected and self.was_cancelled is not None and self.done()
+                and self.was_cancelled(self.seq))
+
+    # Block until the command is done.  True if it finished; False on
+    # timeout, or if it was cancelled or rejected.
+    def wait(self, timeout=None) -> bool:
+        if self.rejected:
+            return False
+        if not self.done():
+            with self.cond:
+                if not self.cond.wait_for(self.done, timeout):
+                    return False
+        return not self.cancelled()
+
+    def __repr__(self):
+        if self.rejected:
+            return "<MoveHandle rejected>"
+        state = "pending" if not self.done() else "cancelled" if self.cancelled() else "done"
+        return f"<MoveHandle seq={self.seq} {state}>"
+
+
+# Block until every handle has finished; the timeout covers the whole set.
+# False if any timed out or was cancelled or rejected.
+def wait_all(handles, timeout=None) -> bool:
+    deadline = None if timeout is None else time.monotonic() + timeout
+    for h in handles:
+        left = None if deadline is None else max(0.0, deadline - time.monotonic())
+        if not h.wait(left):
+            return False
+    return True
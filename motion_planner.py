@@ -0,0 +1,53 @@
+# Lookahead motion planner
+#
+# With an acceleration profile every move normally starts and ends at
+# v_start.  When more moves are already queued, the planner works out how
+# fast the motor may still be going at the end of the current move (the
+# junction speed), so consecutive moves in the same direction blend into
+# one continuous motion:
+#
+#   - a junction between two moves in the same direction may run at v_max,
+#     one that reverses direction must be at v_start
+#   - the last known move ends at v_start, and every junction is slow enough
+#     to stop by then (backward pass)
+#   - the current move can only reach what its length allows from its entry
+#     speed (forward pass)
+#
+# Segments are signed frame counts; speeds are in frames/s.  Only profiles
+# with an accel (TrapezoidalProfile, SCurveProfile) can blend; segment
+# intervals follow a trapezoidal speed curve.
+
+import math
+from array import array
+
+
+# (v_max, accel, v_start) of a profile that can blend, else None
+def limits(profile):
+    if profile is None or not hasattr(profile, "accel"):
+        return None
+    return (profile.v_max, profile.accel, profile.v_start)
+
+
+# Exit speed of segments[0] entered at v0 (None = from rest)
+def exit_speed(profile, segments, v0=None) -> float:
+    v_max, a, v_start = limits(profile)
+    exits = [v_start] * len(segments)
+    for i in range(len(segments) - 2, -1, -1):
+        same_dir = segments[i] * segments[i+1] > 0
+        cap = v_max if same_dir else v_start
+        exits[i] = min(cap, math.sqrt(exits[i+1]**2 + 2*a*abs(segments[i+1])))
+    v0 = v_start if v0 is None else v0
+    return max(v_start, min(exits[0], math.sqrt(v0*v0 + 2*a*abs(segments[0]))))
+
+
+# Interval table [s] for n frames entered at v0 and left at v1.  The speed
+# at frame k is the lowest of v_max, the ramp up from v0 and the ramp down
+# to v1; with constant acceleration between frames the time from frame k to
+# k+1 is exactly 2 / (v_k + v_k+1).
+def segment_intervals(profile, n, v0=None, v1=None) -> array:
+    v_max, a, v_start = limits(profile)
+    v0 = v_start if v0 is None else v0
+    v1 = v_start if v1 is None else v1
+    speed = [min(v_max, math.sqrt(v0*v0 + 2*a*k), math.sqrt(v1*v1 + 2*a*(n - k)))
+             for k in range(n + 1)]
+    return array('d', (2 / (speed[k] + speed[k+1]) for k in range(n)))
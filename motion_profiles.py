@@ -0,0 +1,120 @@
+# Step timing profiles
+#
+# A profile turns a move of n steps into a table of n step intervals [s],
+# computed ahead of time so the stepping loop only indexes an array.
+# interval[k] is the wait after step k.
+#
+#   ConstantProfile(delay_us)                 fixed delay (the old behaviour)
+#   TrapezoidalProfile(v_max, accel)          linear ramp up, cruise, ramp down
+#   SCurveProfile(v_max, accel, jerk)         jerk-limited ramp (smoother)
+#
+# Speeds are in steps/s, accel in steps/s^2 and jerk in steps/s^3.  Every
+# profile starts and stops at v_start, which should be a rate the motor can
+# pull in from rest (the 1200 us default delay is 833 steps/s).  The ramp of
+# a profile is computed once and reused; a short move that cannot reach
+# v_max uses the first half of the ramp and its mirror image.
+
+import math
+from array import array
+
+V_START = 1e6 / 1200        # steps/s, the old fixed delay
+
+
+class Profile:
+    def __init__(self, v_max, v_start=V_START):
+        self.v_max = float(v_max)
+        self.v_start = min(float(v_start), self.v_max)
+        self._ramp = None
+
+    # the ramp is rebuilt after unpickling rather than sent with every move
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_ramp"] = None
+        return state
+
+    # intervals [s] while accelerating from v_start to v_max
+    def _build_ramp(self) -> list:
+        raise NotImplementedError
+
+    def ramp(self) -> list:
+        if self._ramp is None:
+            self._ramp = self._build_ramp()
+        return self._ramp
+
+    # interval table for a move of n steps
+    def compile(self, n) -> array:
+        n = int(n)
+        ramp = self.ramp()
+        r = ramp[:n // 2]
+        if len(r) == len(ramp):
+            cruise = 1.0 / self.v_max
+        else:
+            cruise = r[-1] if r else 1.0 / self.v_start
+        out = array('d', r)
+        out.extend([cruise] * (n - 2 * len(r)))
+        out.extend(reversed(r))
+        return out
+
+    # total time of a move of n steps [s]
+    def duration(self, n) -> float:
+        return math.fsum(self.compile(n))
+
+
+class ConstantProfile(Profile):
+    def __init__(self, delay_us=1200):
+        super().__init__(1e6 / delay_us, 1e6 / delay_us)
+
+    def _build_ramp(self):
+        return []
+
+
+class TrapezoidalProfile(Profile):
+    def __init__(self, v_max, accel, v_start=V_START):
+        super().__init__(v_max, v_start)
+        self.accel = float(accel)
+
+    def _build_ramp(self):
+        v0, a = self.v_start, self.accel
+        n_ramp = int((self.v_max**2 - v0**2) / (2 * a))
+        # time at which step k is reached: s = v0 t + a t^2 / 2
+        t = [(math.sqrt(v0*v0 + 2*a*k) - v0) / a for k in range(n_ramp + 1)]
+        return [t[k+1] - t[k] for k in range(n_ramp)]
+
+
+class SCurveProfile(Profile):
+    def __init__(self, v_max, accel, jerk, v_start=V_START, dt=10e-6):
+        super().__init__(v_max, v_start)
+        self.accel = float(accel)
+        self.jerk = float(jerk)
+        self.dt = float(dt)         # integration step for the ramp [s]
+
+    def _build_ramp(self):
+        v0, vm, a, j = self.v_start, self.v_max, self.accel, self.jerk
+        dv = vm - v0
+        if dv <= 0:
+            return []
+        if dv >= a * a / j:         # reaches full acceleration
+            t1 = a / j
+            t2 = t1 + (dv - a * a / j) / a
+        else:                       # jerk up straight into jerk down
+            a = math.sqrt(j * dv)
+            t1 = t2 = a / j
+        t3 = t2 + t1
+
+        def accel_at(t):
+            if t < t1: return j * t
+            if t < t2: return a
+            return max(0.0, a - j * (t - t2))
+
+        # integrate v and s, recording the time each whole step is crossed
+        times = [0.0]
+        t, v, s = 0.0, v0, 0.0
+        dt = self.dt
+        while t < t3:
+            acc = accel_at(t + dt / 2)
+            s_next = s + v * dt + acc * dt * dt / 2
+            while s_next >= len(times):
+                k = len(times)
+                times.append(t + dt * (k - s) / (s_next - s))
+            s, v, t = s_next, v + acc * dt, t + dt
+        return [times[k+1] - times[k] for k in range(len(times) - 1)]
@@ -0,0 +1,101 @@
+# Seqlock snapshot of every motor's motion
+#
+# One multiprocessing.shared_memory block with a record per motor:
+#
+#   ver      seqlock version, odd while the record is being written
+#   pos      step position [half-steps]
+#   vel      speed of the last step [half-steps/s, signed], 0 when stopped
+#   target   step position the current move ends at
+#
+# Each record has one writer, the motor's stepping worker.  It bumps ver to
+# odd, writes the fields and bumps ver to even again; a reader copies the
+# record and retries while ver was odd or changed underneath it.  Readers
+# never take a lock and never slow the writer down, so a UI or logger can
+# poll as often as it likes:
+#
+#   snap = SnapshotBlock.attach(name)       # any process
+#   for pos, vel, target in snap.snapshot():
+#       ...
+#
+# snapshot_array() returns the same as a NumPy structured array when NumPy
+# is installed.
+
+from multiprocessing import shared_memory
+
+from shared_block import attach_shm
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+FIELDS = ("ver", "pos", "vel", "target")
+VER, POS, VEL, TARGET = range(len(FIELDS))
+NFIELDS = len(FIELDS)
+
+
+class SnapshotBlock:
+
+    def __init__(self, max_motors=16, name=None, create=True):
+        self.max_motors = max_motors
+        size = 8 * NFIELDS * max_motors
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = attach_shm(name)
+            self.max_motors = self.shm.size // (8 * NFIELDS)
+        self.name = self.shm.name
+        self.owner = create
+        self.q = self.shm.buf.cast('q')     # motor i field f at i*NFIELDS + f
+        self.d = self.shm.buf.cast('d')     # the same words as float64, for vel
+        if create:
+            for k in range(len(self.q)):
+                self.q[k] = 0
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name=name, create=False)
+
+    # Writer side: publish motor i's record (only its worker calls this)
+    def publish(self, i, pos, vel, target):
+        q, b = self.q, i * NFIELDS
+        ver = q[b]
+        q[b] = ver + 1              # odd: readers retry
+        q[b+POS] = pos
+        self.d[b+VEL] = vel
+        q[b+TARGET] = target
+        q[b] = ver + 2
+
+    # Consistent (pos, vel, target) of motor i
+    def read(self, i) -> tuple:
+        q, d, b = self.q, self.d, i * NFIELDS
+        while True:
+            ver = q[b]
+            rec = (q[b+POS], d[b+VEL], q[b+TARGET])
+            if not ver & 1 and q[b] == ver:
+                return rec
+
+    # (pos, vel, target) of motors 0..n-1 (default: all), each consistent
+    def snapshot(self, n=None) -> list:
+        return [self.read(i) for i in range(self.max_motors if n is None else n)]
+
+    # The same as a NumPy structured array with fields pos, vel and target
+    def snapshot_array(self, n=None):
+        if np is None:
+            raise ImportError("snapshot_array() needs NumPy")
+        n = self.max_motors if n is None else n
+        dtype = np.dtype([("ver", "<i8"), ("pos", "<i8"), ("vel", "<f8"), ("target", "<i8")])
+        live = np.frombuffer(self.shm.buf, dtype=dtype, count=n)
+        out = live.copy()
+        stale = (out["ver"] & 1).astype(bool) | (live["ver"] != out["ver"])
+        del live                    # an exported view would keep close() from freeing the block
+        for i in np.flatnonzero(stale):     # a writer was busy: read those records again
+            out[i] = (0,) + self.read(i)
+        return out[["pos", "vel", "target"]]
+
+    def close(self):
+        self.q.release()
+        self.d.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
@@ -0,0 +1,97 @@
+# Shared motor state block
+#
+# One multiprocessing.shared_memory block holds a record of int64 fields for
+# every motor, so the stepping workers, the parent and any other process see
+# the same numbers without a lock per value:
+#
+#   pos      step position (integer, so there is no rounding drift)
+#   phase    index into the coil sequence
+#   target   step position the current move ends at
+#   busy     1 while a move is running
+#   seq      number of the last command started
+#   done     number of the last command finished (see motion_handles)
+#   mode     drive mode number (drive_modes.MODE_NAMES)
+#   cancel   commands numbered up to this are cancelled (written by the caller)
+#
+# After the records, each motor has a table of CANCEL_SLOTS int64s
+# (motion_handles) for cancelling single commands: the caller writes seq
+# into slot seq % CANCEL_SLOTS to ask, and the worker writes -seq once it
+# has actually dropped or stopped that command (the caller writes -seq
+# itself for a command drop_oldest overwrites).
+#
+# The motor's worker writes every field except mode and cancel, which only
+# the caller writes (zero() is queued, so the worker applies it too).
+# Aligned 8-byte stores are not torn, so plain reads and writes are
+# enough.  Angles are derived from pos when read.
+
+from multiprocessing import shared_memory
+
+from motion_handles import CANCEL_SLOTS
+from shared_block import attach_shm
+
+FIELDS = ("pos", "phase", "target", "busy", "seq", "done", "mode", "cancel")
+POS, PHASE, TARGET, BUSY, SEQ, DONE, MODE, CANCEL = range(len(FIELDS))
+NFIELDS = len(FIELDS)
+
+
+class MotorStateBlock:
+
+    def __init__(self, max_motors=16, name=None, create=True):
+        self.max_motors = max_motors
+        size = 8 * (NFIELDS + CANCEL_SLOTS) * max_motors
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = attach_shm(name)
+            self.max_motors = self.shm.size // (8 * (NFIELDS + CANCEL_SLOTS))
+        self.name = self.shm.name
+        self.owner = create
+        self.v = self.shm.buf.cast('q')     # flat int64 view, motor i field f at i*NFIELDS + f,
+                                            # then the cancel tables
+        if create:
+            for k in range(len(self.v)):
+                self.v[k] = 0
+
+    @classmethod
+    def attach(cls, name):
+        return cls(name=name, create=False)
+
+    # index of motor i's first field in v
+    def base(self, i) -> int:
+        if not 0 <= i < self.max_motors:
+            raise IndexError(f"motor {i} is outside the state block")
+        return i * NFIELDS
+
+    # index of motor i's cancel table in v
+    def cancel_base(self, i) -> int:
+        self.base(i)
+        return self.max_motors * NFIELDS + i * CANCEL_SLOTS
+
+    def get(self, i, field) -> int:
+        return self.v[self.base(i) + FIELDS.index(field)]
+
+    def set(self, i, field, value):
+        self.v[self.base(i) + FIELDS.index(field)] = value
+
+    def record(self, i) -> dict:
+        b = self.base(i)
+        return dict(zip(FIELDS, self.v[b:b + NFIELDS].tolist()))
+
+    def close(self):
+        self.v.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+# Read-only angle computed from a motor's step position on every read, so
+# m.angle.value keeps working without a stored float
+class AngleView:
+    def __init__(self, block, index, steps_per_degree):
+        self._v = block.v
+        self._pos = block.base(index) + POS
+        self._spd = steps_per_degree
+
+    @property
+    def value(self) -> float:
+        return (self._v[self._pos] / self._spd) % 360
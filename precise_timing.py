@@ -0,0 +1,74 @@
+# Drift-free step timing
+#
+# Sleeping for the step delay after doing the work makes every period the
+# delay plus the work time plus the scheduler's wake-up overshoot, and the
+# error adds up over a move.  DeadlineTimer instead schedules against
+# absolute perf_counter_ns deadlines: each period starts where the last one
+# was due, not where it happened to end.  sleep_until() sleeps coarsely and
+# spins through the last spin_ns, which is about how late a sleep can wake.
+#
+#   timer = DeadlineTimer()
+#   for k in range(n):
+#       step()
+#       timer.wait(intervals[k])    # returns how late it woke [ns]
+#
+# A deadline missed by more than slack_ns is counted as an overrun.  When
+# the loop falls a whole period behind, the schedule restarts from now
+# rather than firing the missed periods back to back.
+
+import time
+
+SPIN_NS = 200_000       # spin through the last 200 us before a deadline
+SLACK_NS = 50_000       # lateness still counted as on time
+
+
+# Sleep, then spin, until perf_counter_ns() reaches deadline_ns; returns
+# how late it returned [ns] (0 or more)
+def sleep_until(deadline_ns, spin_ns=SPIN_NS) -> int:
+    left = deadline_ns - time.perf_counter_ns() - spin_ns
+    if left > 0:
+        time.sleep(left / 1e9)
+    now = time.perf_counter_ns()
+    while now < deadline_ns:
+        now = time.perf_counter_ns()
+    return now - deadline_ns
+
+
+class DeadlineTimer:
+    def __init__(self, spin_ns=SPIN_NS, slack_ns=SLACK_NS):
+        self.spin_ns = spin_ns
+        self.slack_ns = slack_ns
+        self.overruns = 0           # deadlines missed by more than slack_ns
+        self.worst_late_ns = 0
+        self.start()
+
+    # restart the schedule at at_ns (default now)
+    def start(self, at_ns=None):
+        self.next = time.perf_counter_ns() if at_ns is None else at_ns
+
+    def _late(self, late, period, slack):
+        if late > slack:
+            self.overruns += 1
+            self.worst_late_ns = max(self.worst_late_ns, late)
+            if late > period:       # a whole period behind: don't burst
+                self.next = time.perf_counter_ns()
+
+    # Block until interval_s after the previous deadline; returns lateness [ns]
+    def wait(self, interval_s) -> int:
+        period = int(interval_s * 1e9)
+        self.next += period
+        late = sleep_until(self.next, self.spin_ns)
+        self._late(late, period, self.slack_ns)
+        return late
+
+    # Non-blocking form for polled loops: True, and the schedule advances,
+    # once interval_s has passed since the previous deadline.  Lateness up
+    # to a period is the polling loop's, so only a missed period is an overrun.
+    def due(self, interval_s) -> bool:
+        period = int(interval_s * 1e9)
+        late = time.perf_counter_ns() - (self.next + period)
+        if late < 0:
+            return False
+        self.next += period
+        self._late(late, period, period)
+        return True
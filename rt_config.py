@@ -0,0 +1,101 @@
+# Real-time settings for motion worker processes
+#
+# By default a worker runs at normal priority on whatever core Linux picks,
+# so a web request or a burst of logging shows up as step jitter.  An
+# RTConfig pins the worker to chosen cores, asks for a real-time policy and
+# locks its memory; each engine applies it first thing in its worker and
+# reports what it actually got:
+#
+#   rt = RTConfig(cpus={3}, policy="fifo", priority=50, lock_memory=True)
+#   m = Stepper(s, lock, rt=rt)     # or Stepper.rt = rt for every motor
+#   m.rt_report()   # {'pid': ..., 'cpus': [3], 'policy': 'fifo', 'priority': 50,
+#                   #  'memory_locked': True, 'errors': []}
+#
+# On a 4-core Pi, isolcpus=3 on the kernel command line plus cpus={3} gives
+# the workers a core nothing else is scheduled on.  SCHED_FIFO/SCHED_RR and
+# mlockall need root (or CAP_SYS_NICE / CAP_IPC_LOCK and a high enough
+# RLIMIT_RTPRIO / RLIMIT_MEMLOCK); without permission the worker keeps its
+# normal policy and the reason is listed in errors, nothing is raised.
+
+import ctypes
+import ctypes.util
+import multiprocessing
+import os
+
+POLICIES = {"other": os.SCHED_OTHER, "fifo": os.SCHED_FIFO, "rr": os.SCHED_RR}
+_MCL_CURRENT, _MCL_FUTURE = 1, 2
+
+
+class RTConfig:
+    def __init__(self, cpus=None, policy=None, priority=50, lock_memory=False):
+        if policy is not None and policy not in POLICIES:
+            raise ValueError(f"policy must be one of {tuple(POLICIES)}")
+        self.cpus = None if cpus is None else set(cpus)    # None = leave the affinity alone
+        self.policy = policy                                # None = leave the policy alone
+        self.priority = priority                            # 1-99 for fifo/rr
+        self.lock_memory = lock_memory
+
+    # Apply to the calling process and report the settings it ended up with
+    def apply(self) -> dict:
+        errors = []
+        if self.cpus is not None:
+            try:
+                os.sched_setaffinity(0, self.cpus)
+            except OSError as e:
+                errors.append(f"affinity {sorted(self.cpus)}: {e.strerror}")
+        if self.policy is not None:
+            prio = 0 if self.policy == "other" else self.priority
+            try:
+                os.sched_setscheduler(0, POLICIES[self.policy], os.sched_param(prio))
+            except OSError as e:    # usually PermissionError
+                errors.append(f"policy {self.policy}: {e.strerror}")
+        locked = False
+        if self.lock_memory:
+            locked, err = _mlockall()
+            if err:
+                errors.append(f"mlockall: {err}")
+        report = current()
+        report["memory_locked"] = locked
+        report["errors"] = errors
+        return report
+
+    def __repr__(self):
+        return (f"RTConfig(cpus={self.cpus}, policy={self.policy!r}, "
+                f"priority={self.priority}, lock_memory={self.lock_memory})")
+
+
+# Lock all current and future pages of the process into RAM
+def _mlockall():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if libc.mlockall(_MCL_CURRENT | _MCL_FUTURE) == 0:
+            return True, None
+        return False, os.strerror(ctypes.get_errno())
+    except (OSError, AttributeError) as e:     # no libc / no mlockall
+        return False, str(e)
+
+
+# Affinity, policy and priority of the calling process
+def current() -> dict:
+    policy = os.sched_getscheduler(0)
+    name = next((k for k, p in POLICIES.items() if p == policy), str(policy))
+    return {"pid": os.getpid(), "cpus": sorted(os.sched_getaffinity(0)),
+            "policy": name, "priority": os.sched_getparam(0).sched_priority,
+            "memory_locked": False, "errors": []}
+
+
+# One-shot channel for a worker's report back to the process that made it
+class RTReport:
+    def __init__(self):
+        self._r, self._w = multiprocessing.Pipe(duplex=False)
+        self._report = None
+
+    # worker side: apply rt (None = change nothing) and send the result
+    def apply(self, rt):
+        self._w.send(rt.apply() if rt is not None else current())
+
+    # caller side: the worker's report, or None if it has not started yet
+    def get(self, timeout=1.0):
+        if self._report is None and self._r.poll(timeout):
+            self._report = self._r.recv()
+        return self._report
@@ -0,0 +1,19 @@
+# Attaching to a named shared-memory block
+#
+# ShiftStats, MotorStateBlock and SnapshotBlock all let another process
+# attach to the block by name.  Only the process that created a block may
+# unlink it, but before Python 3.13 SharedMemory registers every attach with
+# the resource tracker, which unlinks the block when the attaching process
+# exits.  attach_shm() opens the block without that registration.
+
+from multiprocessing import shared_memory, resource_tracker
+
+
+# Open the existing block name without taking ownership of it
+def attach_shm(name) -> shared_memory.SharedMemory:
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:   # Python < 3.13 has no track= and always tracks
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, "shared_memory")
+        return shm
@@ -0,0 +1,118 @@
+# Shift register / GPIO instrumentation
+#
+# Opt-in counters for Shifter, Stepper and SyncController.  They live in a
+# named shared-memory block, so forked motor workers update the same numbers
+# and any other process can attach by name and read them while things run:
+#
+#   stats = ShiftStats()                 # creates the block
+#   s = Shifter(16, 21, 20, stats=stats)
+#   Stepper.stats = stats                # before the Steppers are created
+#   ...
+#   python -m shift_stats <stats.name>   # dump as JSON from another shell
+#
+# Updates are plain read-modify-writes, so writers must already be
+# serialized (Shifter runs under the Stepper output lock or in the single
+# compositor writer), or each write its own lane: the Stepper workers pass
+# lane=motor index, and snapshot() sums the lanes into the totals, so the
+# step path takes no lock for its counters.  When a component's stats is
+# None the only cost is that one check.
+
+import json
+import sys
+from multiprocessing import shared_memory
+
+from shared_block import attach_shm
+
+FIELDS = ("gpio_writes",      # pin-write calls made by the shifters
+          "frames_latched",   # latch pulses
+          "bytes_shifted",    # register bytes clocked out
+          "shift_ns",         # time spent inside shiftFrames
+          "steps",            # Stepper.__step calls
+          "lock_wait_ns",     # time Stepper waited for the output lock
+          "sleep_ns",         # time Stepper slept between steps
+          "pushes",           # SyncController._push_byte calls
+          "overruns")         # step deadlines missed (precise_timing.DeadlineTimer)
+
+# Frame latency histogram: bucket 0 counts frames under 1 us, bucket i
+# counts [2**(i-1), 2**i) us and the last bucket everything slower.
+NUM_BUCKETS = 24
+LANES = 16          # per-writer copies of FIELDS, one per Stepper
+
+
+class ShiftStats:
+
+    def __init__(self, name=None, create=True):
+        size = 8 * (len(FIELDS) + NUM_BUCKETS + LANES*len(FIELDS))
+        if create:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        else:
+            self.shm = attach_shm(name)
+        self.name = self.shm.name
+        self.owner = create
+        self._v = self.shm.buf.cast('Q')
+        if create:
+            self.reset()
+        for i, f in enumerate(FIELDS):     # field -> slot index
+            setattr(self, "_" + f, i)
+        self._hist = len(FIELDS)
+        self._lanes = len(FIELDS) + NUM_BUCKETS
+
+    # open a block created by another process
+    @classmethod
+    def attach(cls, name):
+        return cls(name, create=False)
+
+    # lane: the caller's own copy of the counters (0..LANES-1), written by
+    # nobody else
+    def add(self, field, n=1, lane=None):
+        i = getattr(self, "_" + field)
+        if lane is not None:
+            i += self._lanes + lane*len(FIELDS)
+        self._v[i] += n
+
+    # one latched frame: its latency, pin writes and register bytes
+    def record_frame(self, ns, writes, num_bytes):
+        v = self._v
+        v[self._gpio_writes] += writes
+        v[self._frames_latched] += 1
+        v[self._bytes_shifted] += num_bytes
+        v[self._shift_ns] += ns
+        v[self._hist + min((ns // 1000).bit_length(), NUM_BUCKETS - 1)] += 1
+
+    def reset(self):
+        for i in range(len(self._v)):
+            self._v[i] = 0
+
+    def snapshot(self) -> dict:
+        v = self._v.tolist()
+        nf = len(FIELDS)
+        snap = {f: v[i] + sum(v[self._lanes + k*nf + i] for k in range(LANES))
+                for i, f in enumerate(FIELDS)}
+        hist = {}
+        for i, n in enumerate(v[self._hist:self._lanes]):
+            if i == 0:
+                label = "<1us"
+            elif i == NUM_BUCKETS - 1:
+                label = f">={2**(i-1)}us"
+            else:
+                label = f"<{2**i}us"
+            hist[label] = n
+        snap["frame_latency"] = hist
+        return snap
+
+    def to_json(self, **kw) -> str:
+        return json.dumps(self.snapshot(), **kw)
+
+    def close(self):
+        self._v.release()
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python -m shift_stats <shared memory name>")
+    st = ShiftStats.attach(sys.argv[1])
+    print(st.to_json(indent=2))
+    st.close()
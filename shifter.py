@@ -1,42 +1,202 @@
 # Shift register class
+#
+# Frame layout: a frame is a bytes-like object (bytes, bytearray, memoryview)
+# with one byte per chained 74HC595.  frame[0] is shifted out first, so it
+# ends up in the register farthest from the Pi; within each byte bit 0 goes
+# first and lands on Qh, bit 7 on Qa.  An integer word of num_bits maps onto
+# the same layout with word_to_frame(), low byte first.
+
+from time import sleep, perf_counter_ns
+from gpio_backends import RPiGPIOBackend, pin_ops
+
+# Per-byte transition tables, indexed [previous data level][byte].  Each
+# entry holds the data level to write before each of the 8 clock pulses
+# (LSB first), or None when the data pin already sits at that level.
+# Index 2 means "level unknown" and always writes the first bit.
+def _build_transitions():
+    tables = ([], [], [])
+    for prev in (0, 1, 2):
+        for b in range(256):
+            level = prev
+            ops = []
+            for i in range(8):
+                bit = (b >> i) & 1
+                ops.append(None if bit == level else bit)
+                level = bit
+            tables[prev].append(tuple(ops))
+    return tables
 
-from RPi import GPIO
-from time import sleep
+_TRANSITIONS = _build_transitions()
+_DATA_WRITES = tuple(tuple(8 - ops.count(None) for ops in t) for t in _TRANSITIONS)
+_UNKNOWN = 2
 
-GPIO.setmode(GPIO.BCM)
+# Pin writes needed to clock one frame out and latch it (for ShiftStats)
+def _frame_writes(frame, level):
+    n = 2
+    for b in frame:
+        n += 16 + _DATA_WRITES[level][b]
+        level = b >> 7
+    return n, level
+
+# Pack the low num_bits of word into a frame, zero-padded at the far end of
+# the chain up to a whole number of registers
+def word_to_frame(word, num_bits):
+    pad = -num_bits % 8
+    return ((word & ((1 << num_bits) - 1)) << pad).to_bytes((num_bits + pad) // 8, "little")
 
 class Shifter():
 
-    def __init__(self, data, clock, latch):
+    # backend defaults to RPi.GPIO; see gpio_backends.py for the others.
+    # stats is an optional shift_stats.ShiftStats.
+    def __init__(self, data, clock, latch, pulse_width=0.0, backend=None, stats=None):
         self.dataPin = data
         self.latchPin = latch
         self.clockPin = clock
-        GPIO.setup(self.dataPin, GPIO.OUT)
-        GPIO.setup(self.latchPin, GPIO.OUT)
-        GPIO.setup(self.clockPin, GPIO.OUT)
+        self.pulse_width = float(pulse_width)   # min clock/latch high time [s], 0 = no sleep
+        self.backend = backend if backend is not None else RPiGPIOBackend()
+        self.stats = stats
+        self.backend.setup(self.dataPin)
+        self.backend.setup(self.latchPin)
+        self.backend.setup(self.clockPin)
+        # (low, high) writers of each pin, resolved once for shiftFrames
+        self._data_ops = pin_ops(self.backend, self.dataPin)
+        self._clock_ops = pin_ops(self.backend, self.clockPin)
+        self._latch_ops = pin_ops(self.backend, self.latchPin)
 
     def ping(self, p):  # ping the clock or latch pin
-        GPIO.output(p,1)
-        sleep(0)
-        GPIO.output(p,0)
+        self.backend.output(p,1)
+        if self.pulse_width:
+            sleep(self.pulse_width)
+        self.backend.output(p,0)
+        if self.stats is not None:
+            self.stats.add("gpio_writes", 2)
+            if p == self.latchPin:
+                self.stats.add("frames_latched")
+
+    # Shift a batch of frames, latching once after each one.  Frames are
+    # bytes-like objects (num_bits=None) or integer words of num_bits; see
+    # the layout at the top.  The data pin is only written when its level
+    # actually changes.
+    def shiftFrames(self, frames, num_bits=None):
+        if num_bits is not None:
+            frames = (word_to_frame(w, num_bits) for w in frames)
+        drive = self._data_ops
+        clock_lo, clock_hi = self._clock_ops
+        latch_lo, latch_hi = self._latch_ops
+        pw = self.pulse_width
+        stats = self.stats
+        # other processes may drive the same pins, so the data level is only
+        # trusted within a single call
+        level = _UNKNOWN
+        for frame in frames:
+            if not isinstance(frame, bytes):
+                frame = memoryview(frame).cast('B')     # iterate without copying
+            if stats is not None:
+                t0 = perf_counter_ns()
+                start_level = level
+            for b in frame:
+                for op in _TRANSITIONS[level][b]:
+                    if op is not None:
+                        drive[op]()
+                    clock_hi()
+                    if pw: sleep(pw)
+                    clock_lo()
+                level = b >> 7
+            latch_hi()
+            if pw: sleep(pw)
+            latch_lo()
+            if stats is not None:
+                ns = perf_counter_ns() - t0
+                stats.record_frame(ns, _frame_writes(frame, start_level)[0], len(frame))
 
     # Shift all bits in an arbitrary-length word, allowing
     # multiple 8-bit shift registers to be chained (with overflow
     # of SR_n tied to input of SR_n+1):
     def shiftWord(self, dataword, num_bits):
-        for i in range((num_bits+1) % 8):  # Load bits short of a byte with 0
-            # self.dataPin.value(0)  # MicroPython for ESP32
-            GPIO.output(self.dataPin, 0) 
-            self.ping(self.clockPin)
-        for i in range(num_bits):          # Send the word
-            # self.dataPin.value(dataword & (1<<i))  # MicroPython for ESP32
-            GPIO.output(self.dataPin, dataword & (1<<i))
-            self.ping(self.clockPin)
-        self.ping(self.latchPin)
+        self.shiftFrames((dataword,), num_bits)
+
+    # Shift one bytes-like frame spanning the whole chain:
+    def shiftBytes(self, frame):
+        self.shiftFrames((frame,))
 
     # Shift all bits in a single byte:
     def shiftByte(self, databyte):
-        self.shiftWord(databyte, 8)
+        self.shiftFrames((databyte,), 8)
+
+    # Turn every output off:
+    def clear(self, num_bits=8):
+        self.shiftWord(0, num_bits)
+
+
+# Several chains driven in parallel.  The chains share the clock and latch
+# pins and each has its own data pin, so one clock edge moves one bit into
+# every chain and the frame time does not grow with the number of chains.
+# Per-chain frames use the Shifter layout; shorter ones are zero-padded at
+# the far end so that all chains latch together.
+class MultiShifter():
+
+    _LANE = 32      # bits per pin mask in the packed per-byte tables
+
+    def __init__(self, data_pins, clock, latch, pulse_width=0.0, backend=None):
+        self.dataPins = list(data_pins)
+        self.latchPin = latch
+        self.clockPin = clock
+        self.pulse_width = float(pulse_width)
+        self.backend = backend if backend is not None else RPiGPIOBackend()
+        for p in self.dataPins + [latch, clock]:
+            self.backend.setup(p)
+        # _spread[c][b] packs the data mask of chain c into lane i (one lane
+        # per clock pulse) wherever bit i of byte b is set, so OR-ing the
+        # entries of all chains gives the data pins to raise on every pulse
+        lane = MultiShifter._LANE
+        self._spread = [[sum((1 << p) << (lane*i) for i in range(8) if b >> i & 1) for b in range(256)]
+                        for p in self.dataPins]
+        self._data_mask = sum(1 << p for p in self.dataPins)
+
+    # Shift a batch of frame sets, latching once after each one.  Each set
+    # holds one bytes-like frame per chain, in data_pins order.
+    def shiftFrames(self, frame_sets):
+        hi, lo = self.backend.set_bits, self.backend.clear_bits
+        clock, latch = 1 << self.clockPin, 1 << self.latchPin
+        all_data = self._data_mask
+        lane, lane_mask = MultiShifter._LANE, (1 << MultiShifter._LANE) - 1
+        shifts = tuple(lane*i for i in range(8))
+        spread = self._spread
+        pw = self.pulse_width
+        level = None            # data pin levels are unknown at the start of a call
+        for frames in frame_sets:
+            if len(frames) != len(spread):
+                raise ValueError(f"expected {len(spread)} frames, got {len(frames)}")
+            frames = [f if isinstance(f, bytes) else memoryview(f).cast('B') for f in frames]
+            width = max(len(f) for f in frames)
+            for k in range(width):
+                packed = 0
+                for table, f in zip(spread, frames):
+                    j = k - (width - len(f))        # shorter chains get zeros first
+                    if j >= 0:
+                        packed |= table[f[j]]
+                for s in shifts:
+                    high = (packed >> s) & lane_mask
+                    if level is None:
+                        if high: hi(high)
+                        if all_data & ~high: lo(all_data & ~high)
+                    else:
+                        if high & ~level: hi(high & ~level)
+                        if level & ~high: lo(level & ~high)
+                    level = high
+                    hi(clock)
+                    if pw: sleep(pw)
+                    lo(clock)
+            hi(latch)
+            if pw: sleep(pw)
+            lo(latch)
+
+    # Shift one frame per chain with a single latch:
+    def shiftChains(self, frames):
+        self.shiftFrames((frames,))
+
+    def clear(self, num_bytes=1):
+        self.shiftChains([bytes(num_bytes)] * len(self.dataPins))
 
 
 # Example:
@@ -46,3 +206,17 @@ class Shifter():
 # for i in range(256):
 #     s.shiftByte(i)
 #     sleep(0.1)
+#
+# Hardware SPI instead of bit-banging (same methods, see spi_shifter.py):
+# from spi_shifter import SPIShifter
+# s = SPIShifter(latch=21)
+#
+# Bulk example (one call, one latch per frame):
+# s.shiftFrames(range(256), 8)
+#
+# Two chains on data pins 16 and 26 sharing clock and latch:
+# ms = MultiShifter(data_pins=[16, 26], clock=20, latch=21)
+# ms.shiftChains([b'\x0f\xf0', b'\x81'])
+#
+# Four chained registers, one latch:
+# s.shiftBytes(bytes([0x01, 0x02, 0x04, 0x08]))   # 0x01 -> farthest register
@@ -0,0 +1,105 @@
+# Hardware-SPI shift register class
+#
+# Drop-in alternative to Shifter for a 74HC595 chain wired to the SPI pins
+# (MOSI -> SER, SCLK -> SRCLK).  Each frame goes out in a single spidev
+# transfer (one ioctl) and the storage latch (RCLK) is pulsed once after it.
+# With latch=None, RCLK is expected on the chip-select line (CE0/CE1), which
+# the kernel raises at the end of every transfer.
+#
+# Frames use the same layout as Shifter (see shifter.py): frame[0] is sent
+# first and every byte is bit-reversed on the way out, since SPI clocks MSB
+# first.
+
+from time import perf_counter_ns
+from gpio_backends import RPiGPIOBackend
+from shifter import word_to_frame
+
+_REV8 = bytes(int(f"{b:08b}"[::-1], 2) for b in range(256))
+
+
+class SPIShifter:
+
+    # spi is an unopened spidev.SpiDev (or FakeSpiDev); one is made if None
+    def __init__(self, latch=None, bus=0, device=0, speed_hz=8_000_000,
+                 spi=None, backend=None, stats=None):
+        if spi is None:
+            import spidev
+            spi = spidev.SpiDev()
+        spi.open(bus, device)
+        spi.max_speed_hz = int(speed_hz)
+        spi.mode = 0            # data sampled on the rising SRCLK edge
+        self.spi = spi
+        self._write = getattr(spi, "writebytes2", spi.writebytes)
+        self.latchPin = latch
+        self.stats = stats      # optional shift_stats.ShiftStats
+        if latch is not None:
+            self.backend = backend if backend is not None else RPiGPIOBackend()
+            self.backend.setup(latch)
+        else:
+            self.backend = None
+
+    def ping(self, p):  # ping the latch pin
+        self.backend.output(p,1)
+        self.backend.output(p,0)
+
+    # Shift a batch of frames (bytes-like, or words of num_bits), one
+    # transfer and one latch per frame
+    def shiftFrames(self, frames, num_bits=None):
+        if num_bits is not None:
+            frames = (word_to_frame(w, num_bits) for w in frames)
+        write = self._write
+        latch = self.latchPin
+        if latch is not None:
+            hi, lo = self.backend.set_bits, self.backend.clear_bits
+            latch = 1 << latch
+        stats = self.stats
+        for frame in frames:
+            if stats is not None:
+                t0 = perf_counter_ns()
+            frame = bytes(frame)
+            write(frame.translate(_REV8))
+            if latch is not None:
+                hi(latch)
+                lo(latch)
+            if stats is not None:
+                stats.record_frame(perf_counter_ns() - t0, 0 if latch is None else 2, len(frame))
+
+    def shiftWord(self, dataword, num_bits):
+        self.shiftFrames((dataword,), num_bits)
+
+    def shiftByte(self, databyte):
+        self.shiftFrames((databyte,), 8)
+
+    def shiftBytes(self, frame):
+        self.shiftFrames((frame,))
+
+    def clear(self, num_bits=8):
+        self.shiftWord(0, num_bits)
+
+    def close(self):
+        self.spi.close()
+
+
+# Stand-in for spidev.SpiDev off the Pi.  Every transfer is kept in
+# transfers as bytes, in the order it reached the bus.
+class FakeSpiDev:
+    def __init__(self):
+        self.bus = self.device = None
+        self.max_speed_hz = 0
+        self.mode = 0
+        self.transfers = []
+
+    def open(self, bus, device):
+        self.bus, self.device = bus, device
+
+    def writebytes2(self, data):
+        self.transfers.append(bytes(data))
+
+    writebytes = writebytes2
+
+    def xfer2(self, data, *args):
+        self.writebytes2(data)
+        return [0] * len(data)
+
+    def close(self):
+        self.bus = self.device = None
@@ -0,0 +1,279 @@
+# Single-process step scheduler
+#
+# One process owns the Shifter and steps every motor from a heap of
+# next-step deadlines.  Motors never contend for a shared output lock, and
+# every tick sends a single combined frame for the whole chain no matter how
+# many motors stepped in it.  Compared with one worker process per Stepper,
+# this is what lets a Pi Zero run more than two motors smoothly.
+#
+#   sched = StepScheduler(s)
+#   m1 = sched.add_motor()          # bits 0-3 of the chain
+#   m2 = sched.add_motor()          # bits 4-7, ...
+#   sched.start()
+#   m1.goAngle(90); m2.rotate(-45)
+#   m1.wait(); m2.wait()
+#   sched.stop()
+#
+# The motors have the rotate/goAngle/run_program/zero/wait/angle interface
+# of the multiprocessing Stepper, and use its half-step sequence and wiring
+# order.
+# A motion_profiles profile can be given per motor (add_motor) or per move.
+# rotate/goAngle/zero return a motion_handles.MoveHandle.  cancel(handle)
+# cancels that one command (stopping it if it is running) and cancel() all
+# of a motor's commands; a cancelled handle is done but reports
+# cancelled(), and its wait() returns False.  Every finished
+# command writes a byte to sched.notify_fd for event loops (async_motion).
+# rt (an rt_config.RTConfig) pins the scheduler process to cores and asks
+# for a real-time policy; rt_report() says what it got.
+
+import heapq
+import math
+import multiprocessing
+import os
+import queue
+import time
+
+from motion_handles import MoveHandle, CANCEL_SLOTS
+from rt_config import RTReport
+
+
+# signed shortest delta in (−180, 180]
+def _shortest_delta(current_deg: float, target_deg: float) -> float:
+    return math.remainder(float(target_deg) - float(current_deg), 360.0)
+
+
+class ScheduledStepper:
+    def __init__(self, sched, index, delay, profile=None):
+        self._sched = sched
+        self.index = index
+        self.delay = delay                              # step period [us]
+        self.profile = profile                          # overrides delay when set
+        self.angle = multiprocessing.Value('d', 0.0)    # updated by the scheduler
+        self._done = multiprocessing.Value('i', 0)      # commands finished
+        self._cancelled = multiprocessing.RawArray('q', CANCEL_SLOTS)  # seq of cancelled commands
+        self._issued = 0                                # commands sent (caller side)
+
+    def _send(self, cmd, val=0.0, profile=None):
+        self._issued += 1
+        self._sched.queue.put((cmd, self.index, val, profile))
+        return self._handle(self._issued)
+
+    def _handle(self, seq):
+        return MoveHandle(self._sched.done, lambda: self._done.value, seq,
+                          lambda s: self._cancelled[s % CANCEL_SLOTS] == s)
+
+    # Move relative angle from current position:
+    def rotate(self, delta, profile=None) -> MoveHandle:
+        return self._send("rel", float(delta), profile)
+
+    # Move to an absolute angle taking the shortest path:
+    def goAngle(self, target_angle, profile=None) -> MoveHandle:
+        return self._send("abs", float(target_angle), profile)
+
+    # Queue a list of moves as one command, as Stepper.run_program; the
+    # handle completes when the last move has finished
+    def run_program(self, moves, profile=None) -> MoveHandle:
+        prog = []
+        for move in moves:
+            if move[0] not in ("rel", "abs"):
+                raise ValueError(f"unknown move {move[0]!r}")
+            prog.append((move[0], float(move[1])) + tuple(move[2:3]))
+        return self._send("prog", prog, profile)
+
+    # Set the motor zero point (applied in order with the queued moves)
+    def zero(self) -> MoveHandle:
+        return self._send("zero")
+
+    # Block until every command sent so far is done (finished or
+    # cancelled); False on timeout
+    def wait(self, timeout=None) -> bool:
+        h = self._handle(self._issued)
+        return h.wait(timeout) or h.done()
+
+    # Cancel the command of handle, or every command sent so far
+    def cancel(self, handle=None):
+        if handle is None:
+            self._sched.queue.put(("cancel", self.index, self._issued, False))
+        elif not handle.rejected:
+            self._sched.queue.put(("cancel", self.index, handle.seq, True))
+
+    @property
+    def notify_fd(self) -> int:
+        return self._sched.notify_fd
+
+
+class StepScheduler:
+    seq = [0b0001,0b0011,0b0010,0b0110,0b0100,0b1100,0b1000,0b1001] # CCW sequence
+    delay = 1200          # default delay between motor steps [us]
+    steps_per_degree = 4096/360    # 4096 steps/rev * 1/360 rev/deg
+
+    # Deadlines closer together than tick_us are served by the same frame
+    def __init__(self, shifter, tick_us=100, rt=None):
+        self.s = shifter
+        self.tick_ns = int(tick_us * 1000)
+        self.rt = rt                    # real-time settings of the scheduler process
+        self._rt_report = RTReport()
+        self.motors = []
+        self.queue = multiprocessing.Queue()
+        self.done = multiprocessing.Condition()
+        self.notify_fd, self._notify_w = os.pipe()     # a byte per finished command
+        os.set_blocking(self.notify_fd, False)
+        os.set_blocking(self._notify_w, False)
+        self.process = None
+
+    def add_motor(self, delay=None, profile=None) -> ScheduledStepper:
+        if self.process is not None:
+            raise RuntimeError("add motors before start()")
+        m = ScheduledStepper(self, len(self.motors), StepScheduler.delay if delay is None else delay,
+                             profile)
+        self.motors.append(m)
+        return m
+
+    def start(self):
+        self.process = multiprocessing.Process(target=self._run, daemon=True)
+        self.process.start()
+
+    # Affinity, policy, priority and memory locking the scheduler process
+    # ended up with, or None if it has not started within timeout
+    def rt_report(self, timeout=1.0):
+        return self._rt_report.get(timeout)
+
+    def stop(self):
+        if self.process is not None:
+            self.queue.put(("stop", -1, 0.0, None))
+            self.process.join()
+            self.process = None
+
+    # ---- everything below runs in the scheduler process ----
+
+    def _finish(self, i, cancelled=False):
+        m = self.motors[i]
+        with self.done:
+            if cancelled:   # recorded before the handle can see it done
+                seq = m._done.value + 1
+                m._cancelled[seq % CANCEL_SLOTS] = seq
+            m._done.value += 1
+            self.done.notify_all()
+        try:
+            os.write(self._notify_w, b"\x01")
+        except BlockingIOError:     # nobody is reading; the fd is only a wake-up
+            pass
+
+    # Start motor i's next pending move, returning True if it needs steps.
+    # Only the last move of a program finishes its command.
+    def _begin(self, i, st):
+        while st["pending"]:
+            cmd, val, profile, seq, cancelled, last = st["pending"].pop(0)
+            st["last"] = last
+            if cancelled:
+                if last:
+                    self._finish(i, cancelled=True)
+                continue
+            if cmd == "zero":      # the coil phase is kept, only the count resets
+                st["pos"] = 0
+                self.motors[i].angle.value = 0.0
+                self._finish(i)
+                continue
+            if cmd == "abs":
+                val = _shortest_delta(self.motors[i].angle.value, val)
+            st["left"] = int(StepScheduler.steps_per_degree * abs(val))
+            st["dir"] = 1 if val > 0 else -1
+            profile = profile or self.motors[i].profile
+            if profile is not None:     # interval table [ns] for the whole move
+                st["periods"] = [int(x * 1e9) for x in profile.compile(st["left"])]
+            else:
+                st["periods"] = None
+            st["k"] = 0
+            if st["left"]:
+                return True
+            if last:
+                self._finish(i)
+        return False
+
+    def _run(self):
+        self._rt_report.apply(self.rt)
+        n = len(self.motors)
+        chain_bits = max(8, -(-4*n // 8) * 8)
+        state = [{"pos": 0, "phase": 0, "left": 0, "dir": 0, "pending": [],
+                  "periods": None, "k": 0, "sent": 0, "last": True} for _ in range(n)]
+        periods = [int(m.delay * 1000) for m in self.motors]
+        heap = []           # (deadline_ns, motor index)
+        frame = 0
+        seq = StepScheduler.seq
+        spd = StepScheduler.steps_per_degree
+        while True:
+            # wait for the next deadline, or for a command if nothing is due.
+            # Queue waits have millisecond granularity, so the last couple of
+            # milliseconds before a deadline are slept instead.
+            timeout = None
+            if heap:
+                timeout = (heap[0][0] - time.perf_counter_ns()) / 1e9
+            msgs = []
+            try:
+                if timeout is None or timeout > 0.002:
+                    msgs.append(self.queue.get(timeout=None if timeout is None else timeout - 0.002))
+                while True:
+                    msgs.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not msgs and heap:
+                left = heap[0][0] - time.perf_counter_ns()
+                if left > 0:
+                    time.sleep(left / 1e9)
+            for cmd, i, val, profile in msgs:
+                if cmd == "stop":
+                    return
+                st = state[i]
+                if cmd == "cancel":
+                    # val is a command number; profile is True to cancel
+                    # only that one, False for everything up to it.
+                    # Commands finish in order: the running one is done + 1.
+                    hit = (lambda q: q == val) if profile else (lambda q: q <= val)
+                    running = self.motors[i]._done.value + 1
+                    if st["left"] and hit(running):
+                        st["left"] = 0      # stop at the current step
+                        heap = [e for e in heap if e[1] != i]
+                        heapq.heapify(heap)
+                        st["pending"] = [e for e in st["pending"] if e[3] != running]  # rest of its program
+                        self._finish(i, cancelled=True)
+                    for entry in st["pending"]:     # finished when reached
+                        if hit(entry[3]):
+                            entry[4] = True
+                else:
+                    # pending moves: [cmd, val, profile, seq, cancelled, last]
+                    st["sent"] += 1
+                    moves = (val or [("rel", 0.0)]) if cmd == "prog" else [(cmd, val)]
+                    for k, move in enumerate(moves):
+                        st["pending"].append([move[0], move[1], move[2] if len(move) > 2 else profile,
+                                              st["sent"], False, k == len(moves) - 1])
+                if not st["left"] and self._begin(i, st):
+                    heapq.heappush(heap, (time.perf_counter_ns(), i))
+
+            # step every motor due within this tick, then send one frame
+            now = time.perf_counter_ns()
+            due = []
+            while heap and heap[0][0] <= now + self.tick_ns:
+                due.append(heapq.heappop(heap))
+            if not due:
+                continue
+            for deadline, i in due:
+                st = state[i]
+                st["pos"] += st["dir"]
+                st["phase"] = (st["phase"] + st["dir"]) % 8
+                st["left"] -= 1
+                shift = 4*i
+                frame = (frame & ~(0b1111 << shift)) | (seq[st["phase"]] << shift)
+            self.s.shiftWord(frame, chain_bits)
+            for deadline, i in due:
+                st = state[i]
+                self.motors[i].angle.value = (st["pos"] / spd) % 360
+                if not st["left"]:
+                    if st["last"]:
+                        self._finish(i)
+                    if not self._begin(i, st):
+                        continue
+                # absolute deadlines, restarting from now if we fell behind
+                period = periods[i] if st["periods"] is None else st["periods"][st["k"]]
+                st["k"] += 1
+                nxt = deadline + period
+                heapq.heappush(heap, (nxt if nxt > now else now + period, i))
@@ -1,7 +1,14 @@
+import os
 import time
+import threading
 from multiprocessing import Value
 from shifter import Shifter as CourseShifter
-import RPi.GPIO as GPIO
+from precise_timing import DeadlineTimer
+from drive_modes import HALF_SEQ, get_mode
+try:
+    import RPi.GPIO as GPIO
+except ImportError:     # off the Pi; pass a Shifter on hc595_sim.HC595Chain
+    GPIO = None
 
 # helpers
 def _rev8(b: int) -> int:
@@ -13,33 +20,46 @@ def _rev8(b: int) -> int:
 
 # motor class
 class Stepper:
-    # full-step (single coil) sequence; invert=True flips direction
-    _seq     = (0b0001, 0b0010, 0b0100, 0b1000)     # A B C D
-    _seq_inv = tuple(reversed(_seq))                # D C B A
+    # drive_mode (drive_modes): "wave" is single coil full steps A B C D,
+    # "full" two-coil full steps, "half" half steps; invert=True flips
+    # direction.  steps_per_rev counts full steps, positions are kept in
+    # half-steps so the mode can change between moves.
 
+    # profile (motion_profiles) replaces the fixed step_delay when given
     def __init__(self, nibble: str, steps_per_rev: int = 2048,
-                 step_delay: float = 0.012, invert: bool = False):
+                 step_delay: float = 0.012, invert: bool = False,
+                 profile=None, drive_mode: str = "wave"):
         assert nibble in ("low", "high")
         self.nibble = nibble
         self.steps_per_rev = int(steps_per_rev)
-        self.step_delay = float(step_delay)
+        self.step_delay = float(step_delay)     # per frame
         self.invert = bool(invert)
+        self.profile = profile
+        self.move_profile = profile     # profile of the current move
+        self.mode = get_mode(drive_mode)
 
-        # track position as integer steps (avoids float rounding)
+        # track position as integer half-steps (avoids float rounding)
         self.step_pos = 0
         self.target_step = 0
 
         # angle view (shared-friendly)
         self.angle = Value('d', 0.0)
-        self._deg_per_step = 360.0 / self.steps_per_rev
+        self._half_steps_per_rev = 2 * self.steps_per_rev
+        self._deg_per_step = 360.0 / self._half_steps_per_rev
 
-    # current 4-phase index (0..3)
+    # takes effect on the next frame; a SyncController replans the rest of
+    # the move for the new mode
+    def set_drive_mode(self, drive_mode: str):
+        self.mode = get_mode(drive_mode)
+
+    # current index (0..7) into the half-step table; inverted motors walk
+    # it backwards from D
     def _phase_index(self) -> int:
-        return self.step_pos & 0x3
+        return (6 - self.step_pos) % 8 if self.invert else self.step_pos % 8
 
     # return this motor's 8-bit mask in the shared output byte
     def coil_mask_now(self) -> int:
-        phase = (Stepper._seq_inv if self.invert else Stepper._seq)[self._phase_index()]
+        phase = HALF_SEQ[self._phase_index()]
         return (phase if self.nibble == "low" else (phase << 4)) & 0xFF
 
     def _update_angle_view(self):
@@ -50,58 +70,234 @@ class Stepper:
         self.target_step = 0
         self._update_angle_view()
 
-    # absolute move to angle a (deg) using shortest path
-    def goAngle(self, a: float):
+    # absolute move to angle a (deg) using shortest path; profile applies
+    # to this move only
+    def goAngle(self, a: float, profile=None):
+        self.move_profile = profile or self.profile
         tgt_nom = int(round(a / self._deg_per_step))
-        cur_mod = self.step_pos % self.steps_per_rev
-        tgt_mod = tgt_nom % self.steps_per_rev
+        rev = self._half_steps_per_rev
+        cur_mod = self.step_pos % rev
+        tgt_mod = tgt_nom % rev
         delta = tgt_mod - cur_mod
-        half = self.steps_per_rev // 2
-        if delta >  half: delta -= self.steps_per_rev
-        if delta < -half: delta += self.steps_per_rev
+        half = rev // 2
+        if delta >  half: delta -= rev
+        if delta < -half: delta += rev
         self.target_step = self.step_pos + delta
 
     def at_target(self) -> bool:
         return self.step_pos == self.target_step
 
-    # one step toward target (returns True if stepped)
+    # frames (calls to step_toward_target) left in the current move
+    def steps_to_go(self) -> int:
+        return self.mode.frames(self.step_pos % 8, abs(self.target_step - self.step_pos))
+
+    # one frame toward target, one or two half-steps (returns True if stepped)
     def step_toward_target(self) -> bool:
         if self.at_target():
             return False
-        self.step_pos += 1 if self.target_step > self.step_pos else -1
+        d = 1 if self.target_step > self.step_pos else -1
+        k = min(self.mode.next[d][self.step_pos % 8][1], abs(self.target_step - self.step_pos))
+        self.step_pos += d * k
         self._update_angle_view()
         return True
 
 
 # controller for motor lockstep
+#
+# Either call run_until_all_reached(motors) after setting targets, or run
+# the loop in the background:
+#
+#   ctrl.attach(m1, m2); ctrl.start()
+#   m1.goAngle(90)          # picked up on the next tick
+#   ctrl.wait_all()         # every attached motor at its target
+#   ctrl.stop()
+#
+# Whenever every attached motor arrives, and on stop(), the loop writes a
+# byte to ctrl.notify_fd, so an event loop can wait for it instead
+# (async_motion.AsyncController).
+#
+# The background loop ticks every idle_tick while nothing moves, holding
+# the coils, and replans from the current positions whenever a target or
+# drive mode changes, or a plan runs out before every motor got there.
+# Don't call run_until_all_reached while it runs.
 class SyncController:
-    def __init__(self, data_pin: int, latch_pin: int, clock_pin: int):
-        self.s = CourseShifter(data=data_pin, latch=latch_pin, clock=clock_pin)
+    # pass shifter= to use an existing Shifter/SPIShifter instead of pins;
+    # stats is an optional shift_stats.ShiftStats shared with the shifter
+    def __init__(self, data_pin: int = None, latch_pin: int = None,
+                 clock_pin: int = None, shifter=None, stats=None):
+        if shifter is None:
+            shifter = CourseShifter(data=data_pin, latch=latch_pin, clock=clock_pin)
+        self.s = shifter
+        self.stats = stats
+        if stats is not None and getattr(shifter, "stats", None) is None:
+            shifter.stats = stats
+        self.motors = []                        # attached motors
+        self.idle_tick = 0.01                   # background tick with nothing to do [s]
+        self._idle = threading.Condition()      # notified when all attached motors are idle
+        self._thread = None
+        self._running = False
+        self.notify_fd, self._notify_w = os.pipe()  # a byte per arrival, for event loops
+        os.set_blocking(self.notify_fd, False)
+        os.set_blocking(self._notify_w, False)
 
     def _push_byte(self, b: int):
+        if self.stats is not None:
+            self.stats.add("pushes")
         # the course shifter clocks LSB-first, so reverse once here
         self.s.shiftByte(_rev8(b))
 
-    def run_until_all_reached(self, motors):
-        delay = max(m.step_delay for m in motors) if motors else 0.01
-        while True:
-            # if already at targets, still refresh outputs so coils are held
-            if all(m.at_target() for m in motors):
-                out = 0
-                for m in motors: out |= m.coil_mask_now()
-                self._push_byte(out)
-                break
-
-            # take one step on whichever still needs it
-            for m in motors:
-                m.step_toward_target()
+    # Plan a coordinated move.  The motor with the most steps to go (the
+    # lead) steps on every tick; each other motor steps at most once every
+    # n // steps ticks, so the tick is the shortest one that keeps every
+    # motor within its own step_delay.  A lead with a profile uses its
+    # interval table instead, stretched if a slower motor needs it.
+    # Returns the tick intervals [s], one per lead step.
+    def _plan(self, motors) -> list:
+        moving = [m for m in motors if not m.at_target()]
+        if not moving:
+            return []
+        lead = max(moving, key=lambda m: m.steps_to_go())
+        n = lead.steps_to_go()
+        others = [m for m in moving if m is not lead]
+        if lead.move_profile is not None:
+            intervals = lead.move_profile.compile(n)
+            shortest = min(intervals)
+            scale = max([1.0] + [m.step_delay / ((n // m.steps_to_go()) * shortest) for m in others])
+            return [t * scale for t in intervals]
+        tick = max(m.step_delay / (n // m.steps_to_go()) for m in moving)
+        return [tick] * n
+
+    # Coordinated linear move: every motor runs through its steps in the
+    # same number of ticks, interleaved with a Bresenham/DDA error term, so
+    # all of them arrive together and the path is a straight line.  Takes
+    # one tick per iteration and yields the time until the next one [s].
+    def _ticks(self, motors):
+        intervals = self._plan(motors)
+        n = len(intervals)
+        moving = [m for m in motors if not m.at_target()]
+        counts = [m.steps_to_go() for m in moving]
+        err = [0] * len(moving)
+        for tick in range(n):
+            for i, m in enumerate(moving):
+                err[i] += counts[i]
+                if 2 * err[i] >= n:     # the lead (counts == n) steps every tick
+                    err[i] -= n
+                    m.step_toward_target()
 
             # combine the two nibbles and send one byte
             out = 0
             for m in motors: out |= m.coil_mask_now()
             self._push_byte(out)
 
-            time.sleep(delay)
+            yield intervals[tick]
+
+    def run_until_all_reached(self, motors):
+        timer = DeadlineTimer()     # absolute deadlines, so work time does not add to each tick
+        while True:
+            for dt in self._ticks(motors):
+                timer.wait(dt)
+            if all(m.at_target() for m in motors):
+                break               # else a mode change left frames to go: plan the rest
+        if self.stats is not None:
+            self.stats.add("overruns", timer.overruns)
+
+        # at the targets: still refresh outputs so coils are held
+        out = 0
+        for m in motors: out |= m.coil_mask_now()
+        self._push_byte(out)
+
+    # ---- background loop ----
+
+    def attach(self, *motors):
+        for m in motors:
+            if m not in self.motors:
+                self.motors.append(m)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._background, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            with self._idle:        # wake wait_all() callers, the motors won't get there now
+                self._running = False
+                self._idle.notify_all()
+            self._thread.join()
+            self._thread = None
+            self._notify()
+
+    def _notify(self):
+        try:
+            os.write(self._notify_w, b"\x01")
+        except BlockingIOError:     # nobody is reading; the fd is only a wake-up
+            pass
+
+    # Handle-like view of the motors (default: all attached) reaching their
+    # targets, for event loops: done() once they are there or the loop
+    # stopped, cancelled() if it stopped first
+    def arrival(self, motors=None):
+        return _Arrival(self, list(self.motors if motors is None else motors))
+
+    # Block until every attached motor is at its target.  False on timeout,
+    # or if the background loop is not running (or stops) before then.
+    def wait_all(self, timeout=None) -> bool:
+        arrived = lambda: all(m.at_target() for m in self.motors)
+        with self._idle:
+            self._idle.wait_for(lambda: arrived() or not self._running, timeout)
+            return arrived()
+
+    def _background(self):
+        timer = DeadlineTimer()
+        ticks, planned, held = iter(()), None, None
+        moving = False
+        while self._running:
+            targets = [(m.target_step, m.mode) for m in self.motors]
+            if targets != planned:      # new or changed targets or modes: plan from here
+                ticks, planned = self._ticks(self.motors), targets
+            dt = next(ticks, None)
+            if dt is None and not all(m.at_target() for m in self.motors):
+                ticks = self._ticks(self.motors)    # the plan ran out short: plan the rest
+                dt = next(ticks, None)
+            if dt is None:              # at the targets: hold the coils
+                out = 0
+                for m in self.motors: out |= m.coil_mask_now()
+                if out != held:
+                    self._push_byte(out)
+                    held = out
+                with self._idle:
+                    self._idle.notify_all()
+                if moving:
+                    self._notify()
+                    moving = False
+                dt = self.idle_tick
+            else:
+                held = None
+                moving = True
+            timer.wait(dt)
+        if self.stats is not None:
+            self.stats.add("overruns", timer.overruns)
+
+
+# SyncController.arrival(): the MoveHandle checks async_motion makes
+class _Arrival:
+    rejected = False
+
+    def __init__(self, ctrl, motors):
+        self.ctrl = ctrl
+        self.motors = motors
+
+    def arrived(self) -> bool:
+        return all(m.at_target() for m in self.motors)
+
+    def done(self) -> bool:
+        return self.arrived() or not self.ctrl._running
+
+    # the loop stopped before the motors got there
+    def cancelled(self) -> bool:
+        return self.done() and not self.arrived()
 
 
 # question 4 demonstration
@@ -5,11 +5,25 @@
 # Because only one motor action is allowed at a time, multithreading could be
 # used instead of multiprocessing. However, the GIL makes the motor process run 
 # too slowly on the Pi Zero, so multiprocessing is needed.
-import RPi.GPIO as GPIO
+try:
+    import RPi.GPIO as GPIO
+except ImportError:     # off the Pi; pass a Shifter on hc595_sim.HC595Chain
+    GPIO = None
 import time
+import atexit
+import os
 import multiprocessing
+import queue
 import math
 from shifter import Shifter   # our custom Shifter class
+from motor_state import MotorStateBlock, AngleView, POS, PHASE, TARGET, BUSY, SEQ, DONE, MODE, CANCEL
+from drive_modes import MODE_NAMES, get_mode
+from motion_handles import MoveHandle, CANCEL_SLOTS
+from precise_timing import DeadlineTimer
+from motion_planner import limits, exit_speed, segment_intervals
+from command_ring import CommandRing, REL, ABS, EXT, ZERO
+from motor_snapshot import SnapshotBlock
+from rt_config import RTReport
 
 # signed shortest delta in (−180, 180]
 def _shortest_delta(current_deg: float, target_deg: float) -> float:
@@ -36,25 +50,126 @@ class Stepper:
     An instance attribute (shifter_bit_start) tracks the bit position
     in the shift register where the 4 control bits for each motor
     begin.
+
+    Every step shifts the whole chain (chain_bits, rounded up to whole
+    registers), so any number of daisy-chained registers is driven with
+    a single latch.  shifter_outputs is 64 bits wide, enough for 16 motors.
+
+    Position, coil phase, move target, busy flag and move sequence number
+    of every motor live as integers in one shared state block
+    (motor_state.MotorStateBlock), so the parent, the workers and any other
+    process read the same values.  angle.value is computed from the step
+    position when it is read.  The worker also publishes position, speed
+    and target of every step to a seqlock block (motor_snapshot), which
+    read_motion() or any other process reads without a lock.
+
+    rotate() and goAngle() return a motion_handles.MoveHandle; wait() blocks
+    until every command sent so far has finished.  run_program() sends a
+    whole list of moves as one message.
+
+    Commands go to the worker through a shared-memory ring (command_ring)
+    of fixed-size records, so sending one takes microseconds; programs and
+    moves with their own profile also put the message on a
+    multiprocessing.Queue, which the ring record points to.  The ring holds
+    maxsize commands (ring_size when maxsize is 0), and overflow chooses
+    what a full ring does to a new command:
+    "block" until there is room, "drop_oldest" pending command (its handle
+    reports it cancelled), "drop_newest"
+    (the new command is discarded and a rejected handle returned, see
+    motion_handles) or "error" (queue.Full).
+    With coalesce=True a run of pending absolute targets collapses to the
+    latest one, so a motor fed targets faster than it can move goes straight
+    to the newest; a superseded target's handle completes with the target
+    that replaced it.
+
+    With Stepper.compositor set, a step only publishes this motor's nibble
+    to the compositor, whose writer process merges all motors and shifts at
+    most once per tick; the shifter_outputs lock is not used.  The step
+    counts once the writer has latched it.
+
+    With an acceleration profile, the worker looks ahead through up to
+    lookahead queued moves and plans junction speeds (motion_planner), so
+    moves in the same direction blend without stopping in between.  A
+    blended move's handle completes as it passes its target.  Looking ahead
+    peeks at the ring without taking anything off it, so queued moves
+    always count against maxsize and the overflow policy; without a profile
+    that can blend the worker does not look ahead at all.
+
+    cancel(handle) cancels that one command, stopping it at its current
+    step if it is running; cancel() cancels everything sent so far.  A
+    cancelled command's handle is done, but cancelled() is True and wait()
+    returns False.  Every finished command also writes a byte to notify_fd,
+    so an event loop can watch it (async_motion).
+
+    With rt (or Stepper.rt) set to an rt_config.RTConfig, the worker pins
+    itself to those cores, asks for a real-time policy and locks its memory
+    before its first step; rt_report() says what it actually got.
+
+    drive_mode is "half" (the seq table, one half-step per frame), "full" or
+    "wave" (two half-steps per frame, see drive_modes).  Positions are always
+    in half-steps, so set_drive_mode() can switch between moves without
+    losing position; delay and profiles are per frame.
     """
 
     # Class attributes:
     num_steppers = 0      # track number of Steppers instantiated
-    shifter_outputs = multiprocessing.Value('i',0)   # track shift register outputs for all motors
+    shifter_outputs = multiprocessing.Value('q',0)   # track shift register outputs for all motors
+    chain_bits = multiprocessing.Value('i',8)        # width of the register chain, shared with the workers
     seq = [0b0001,0b0011,0b0010,0b0110,0b0100,0b1100,0b1000,0b1001] # CCW sequence
     delay = 1200          # delay between motor steps [us]
     steps_per_degree = 4096/360    # 4096 steps/rev * 1/360 rev/deg
+    stats = None          # optional shift_stats.ShiftStats, set before creating motors
+    profile = None        # default motion_profiles profile for all motors (None = fixed delay)
+    state = None          # motor_state.MotorStateBlock shared by all motors, made by the first motor
+    snapshot = None       # motor_snapshot.SnapshotBlock published by the workers, made with state
+    compositor = None     # optional frame_compositor.FrameCompositor that owns the Shifter
+    ring_size = 1024      # commands a motor with maxsize=0 can have pending
+    rt = None             # default rt_config.RTConfig for the workers (None = normal priority)
 
-    def __init__(self, shifter, lock):
+    overflow_policies = ("block", "drop_oldest", "drop_newest", "error")
+
+    def __init__(self, shifter, lock, profile=None, maxsize=0, overflow="block", coalesce=False,
+                 drive_mode="half", lookahead=8, rt=None):
+        if overflow not in Stepper.overflow_policies:
+            raise ValueError(f"overflow must be one of {Stepper.overflow_policies}")
+        mode = get_mode(drive_mode)
         self.s = shifter           # shift register
-        self.angle = multiprocessing.Value('d',0.0) # current output shaft as shared double
-        self.step_state = 0        # track position in sequence
+        self.profile = profile     # this motor's profile, overrides Stepper.profile
+        self.index = Stepper.num_steppers       # record in the state block
         self.shifter_bit_start = 4*Stepper.num_steppers  # starting bit position
         self.lock = lock           # multiprocessing lock
         
         Stepper.num_steppers += 1   # increment the instance count
+        if Stepper.num_steppers > 16:
+            raise ValueError("shifter_outputs only has room for 16 motors")
+        if Stepper.state is None:   # created before any worker is forked
+            Stepper.state = MotorStateBlock(16)
+            atexit.register(Stepper.state.close)    # release the view before the block is freed
+            Stepper.snapshot = SnapshotBlock(16)
+            atexit.register(Stepper.snapshot.close)
+        self.base = Stepper.state.base(self.index)  # first field of this motor
+        self.cbase = Stepper.state.cancel_base(self.index)  # this motor's cancel table
+        if Stepper.compositor is not None:
+            Stepper.compositor.register(self.index)
+        self.angle = AngleView(Stepper.state, self.index, Stepper.steps_per_degree)  # derived from the step count
+        Stepper.state.v[self.base+MODE] = MODE_NAMES.index(mode.name)
+        self.done = multiprocessing.Condition()     # notified when the worker finishes a command
+        self.notify_fd, self._notify_w = os.pipe()  # a byte per finished command, for event loops
+        os.set_blocking(self.notify_fd, False)
+        os.set_blocking(self._notify_w, False)
+        self._issued = 0                            # commands sent (caller side)
+        with Stepper.chain_bits.get_lock():     # grow the chain to whole registers
+            Stepper.chain_bits.value = max(Stepper.chain_bits.value, -(-4*Stepper.num_steppers // 8) * 8)
 
-        self.queue = multiprocessing.Queue()        # creates queue system for multiple rotate commands
+        self.overflow = overflow   # what a full ring does to a new command
+        self.coalesce = coalesce   # collapse pending absolute targets to the latest
+        self.lookahead = lookahead # queued moves considered for junction speeds (0 = off)
+        self.ring = CommandRing(maxsize or Stepper.ring_size)  # commands for the worker
+        atexit.register(self.ring.close)
+        self.queue = multiprocessing.Queue()        # messages that do not fit a ring record
+        self._ext = {}                              # worker: queue messages read so far, by seq
+        self.rt = rt if rt is not None else Stepper.rt  # real-time settings of the worker
+        self._rt_report = RTReport()
         self.worker = multiprocessing.Process(target=self.__worker_loop)
         self.worker.daemon = True
         self.worker.start()
@@ -64,56 +179,308 @@ class Stepper:
         if x == 0: return(0)
         else: return(int(abs(x)/x))
 
-    # Move a single +/-1 step in the motor sequence:
-    def __step(self, dir):
-        self.step_state += dir    # increment/decrement the step
-        self.step_state %= 8      # ensure result stays in [0,7]
+    # Move to the given position in the motor sequence, one or two
+    # half-steps away in direction dir:
+    def __step(self, phase, dir):
+        v, b = Stepper.state.v, self.base
+        moved = (phase - v[b+PHASE]) * dir % 8
+        v[b+PHASE] = phase
         
+        stats = Stepper.stats
+        comp = Stepper.compositor
+        if comp is not None:        # the compositor's writer does the shifting
+            comp.wait_latched(self.index, comp.publish(self.index, Stepper.seq[phase]))
+            v[b+POS] += dir * moved     # only once the coils have it
+            if stats is not None:   # this motor's own lane, no lock
+                stats.add("steps", lane=self.index)
+            return
+        if stats is not None:
+            t0 = time.perf_counter_ns()
         with Stepper.shifter_outputs.get_lock():        # requires lock on outputs
+            if stats is not None:
+                stats.add("lock_wait_ns", time.perf_counter_ns() - t0, lane=self.index)
+                stats.add("steps", lane=self.index)
             current_output = Stepper.shifter_outputs.value      # copies old outputs
             mask = 0b1111 << self.shifter_bit_start     # write 1s for this motor
-            new_output = (current_output & ~mask) | (Stepper.seq[self.step_state] << self.shifter_bit_start)       # clear this motors bits
+            new_output = (current_output & ~mask) | (Stepper.seq[phase] << self.shifter_bit_start)       # clear this motors bits
             Stepper.shifter_outputs.value = new_output      # copy the new output to shared variable
-            self.s.shiftByte(Stepper.shifter_outputs.value)     # execute the output to shift register
+            self.s.shiftWord(new_output, Stepper.chain_bits.value)     # execute the output to the whole chain
             
-        with self.angle.get_lock():     # require lock on angle for this motor
-            self.angle.value += dir/Stepper.steps_per_degree
-            self.angle.value %= 360     # limit to [0,359.9+] range
+        v[b+POS] += dir * moved     # only this motor's worker writes its position while moving
 
-    # Move relative angle from current position:
-    def __rotate(self, delta):
+    # Move relative angle from current position, entering at v0 and
+    # leaving at v1 [frames/s] (None = from/to rest).  Returns False if the
+    # move was cancelled part way:
+    def __rotate(self, delta, profile=None, v0=None, v1=None):
+        profile = profile or self.profile or Stepper.profile
         with self.lock:     # require lock for this motor
             numSteps = int(Stepper.steps_per_degree * abs(delta))    # find the right # of steps
             dir = self.__sgn(delta)        # find the direction (+/-1)
-            for s in range(numSteps):      # take the steps
-                self.__step(dir)
-                time.sleep(Stepper.delay/1e6)
+            v, b = Stepper.state.v, self.base
+            v[b+TARGET] = v[b+POS] + dir*numSteps
+            v[b+BUSY] = 1
+            snap = Stepper.snapshot
+            snap.publish(self.index, v[b+POS], 0.0, v[b+TARGET])
+            mode = get_mode(MODE_NAMES[v[b+MODE]])
+            phases = mode.plan(v[b+PHASE], dir, numSteps) if dir else []   # coil entry of each frame
+            if (v0 is not None or v1 is not None) and limits(profile) is not None:
+                intervals = segment_intervals(profile, len(phases), v0, v1)    # blended move
+            elif profile is not None:      # precomputed step intervals [s]
+                intervals = profile.compile(len(phases))
+            else:
+                intervals = [Stepper.delay/1e6] * len(phases)
+            timer = DeadlineTimer()        # step k is due at the sum of intervals[:k]
+            finished = True
+            seq = v[b+SEQ]
+            slot = self.cbase + seq % CANCEL_SLOTS
+            for s in range(len(phases)):   # take the steps
+                if v[b+CANCEL] >= seq or abs(v[slot]) == seq:  # -seq: dropped by drop_oldest
+                    finished = False       # stop where we are; position stays exact
+                    break
+                p = v[b+POS]
+                self.__step(phases[s], dir)
+                snap.publish(self.index, v[b+POS], (v[b+POS] - p) / intervals[s], v[b+TARGET])
+                if Stepper.stats is not None:
+                    t0 = time.perf_counter_ns()
+                    timer.wait(intervals[s])
+                    Stepper.stats.add("sleep_ns", time.perf_counter_ns() - t0, lane=self.index)
+                else:
+                    timer.wait(intervals[s])
+            if Stepper.stats is not None and timer.overruns:
+                Stepper.stats.add("overruns", timer.overruns, lane=self.index)
+            v[b+TARGET] = v[b+POS]
+            v[b+BUSY] = 0
+            snap.publish(self.index, v[b+POS], 0.0, v[b+POS])
+        return finished
+
+    # Queue message -> pending moves (cmd, val, profile, seq, last).  A
+    # program becomes its moves; only the last one completes the command.
+    def __take(self, msg, pending):
+        cmd, val, profile, seq = msg
+        if cmd != "prog":
+            pending.append((cmd, val, profile, seq, True))
+            return
+        moves = val or [("rel", 0.0)]
+        for k, move in enumerate(moves):
+            pending.append((move[0], move[1], move[2] if len(move) > 2 else profile,
+                            seq, k == len(moves) - 1))
+
+    # Ring record -> message (cmd, val, profile, seq).  An EXT record's
+    # message is on the queue, in seq order; the ones read past on the way
+    # belong to records that were peeked at or dropped (drop_oldest).
+    def __unpack(self, rec):
+        kind, val, seq = rec
+        if kind != EXT:
+            return (("rel", "abs", None, "zero")[kind], val, None, seq)
+        while seq not in self._ext:
+            msg = self.queue.get()
+            self._ext[msg[3]] = msg
+        return self._ext[seq]
+
+    # Next message from the ring, or None if block is False and nothing is
+    # waiting
+    def __recv(self, block):
+        rec = self.ring.get() if block else self.ring.pop()
+        if rec is None:
+            return None
+        msg = self.__unpack(rec)
+        for k in [k for k in self._ext if k <= rec[2]]:    # taken, or their record was dropped
+            del self._ext[k]
+        return msg
+
+    # Up to n moves that follow: the rest of the running program, then the
+    # records still on the ring, peeked at and left there
+    def __ahead(self, pending, n) -> list:
+        moves = list(pending[:n])
+        for rec in self.ring.peek(n - len(moves)):
+            self.__take(self.__unpack(rec), moves)
+        return moves[:n]
+
+    # Next move to run: the rest of the running program, else the next ring
+    # record.  When coalescing, an absolute target with another one queued
+    # right behind it is skipped for the newer one.
+    def __next_command(self, pending, coalesce):
+        if not pending:
+            self.__take(self.__recv(True), pending)
+        while coalesce and len(pending) == 1 and pending[0][0] == "abs" and pending[0][4]:
+            ahead = self.__ahead([], 1)
+            if not ahead or ahead[0][0] != "abs":
+                break
+            self.__take(self.__recv(False), pending)
+            if pending[1][0] == "abs":  # drop_oldest may have replaced the one peeked at
+                pending.pop(0)      # done once the newer target (higher seq) is
+        return pending.pop(0)
+
+    # Speed to leave a move at [frames/s], given the moves that follow
+    # (__ahead); None when the profile cannot blend or nothing follows
+    def __junction(self, delta, profile, v0, ahead):
+        lim = limits(profile)
+        if lim is None or not ahead:
+            return None
+        v, b = Stepper.state.v, self.base
+        mode = get_mode(MODE_NAMES[v[b+MODE]])
+        spd = Stepper.steps_per_degree
+        n = int(spd * abs(delta))
+        pos = v[b+POS] + self.__sgn(delta) * n
+        segs = [self.__sgn(delta) * mode.frames(v[b+PHASE], n)]
+        for cmd, val, prof, seq, last in ahead:
+            if self.__cancelled(seq) or cmd == "zero":
+                break           # will be dropped / the motor stops to re-zero
+            if limits(prof or self.profile or Stepper.profile) != lim:
+                break           # a move with other limits starts from rest
+            d = val if cmd == "rel" else _shortest_delta((pos / spd) % 360, val)
+            k = int(spd * abs(d))
+            pos += self.__sgn(d) * k
+            segs.append(self.__sgn(d) * -(-k // mode.stride))
+        if len(segs) == 1:
+            return None
+        return exit_speed(profile, segs, v0)
 
     def __worker_loop(self):
+        self._rt_report.apply(self.rt)
+        v, b = Stepper.state.v, self.base
+        pending = []    # the rest of the running program
+        into = None     # seq of the move the last one blended into
+        v0 = None       # speed carried into it
         while True:
-            cmd, val = self.queue.get()   # ("rel", delta) or ("abs", target)
-            if cmd == "rel":
-                self.__rotate(val)
-            else:  # "abs"
-                with self.angle.get_lock():
-                    current = self.angle.value
-                delta = _shortest_delta(current, val)
-                self.__rotate(delta)
+            # ("rel", delta, ...), ("abs", target, ...) or ("zero", ...); see __take
+            cmd, val, profile, seq, last = self.__next_command(pending, self.coalesce and into is None)
+            if seq != into:
+                v0 = None           # drop_oldest replaced it: the last move stopped short
+            into = None
+            v[b+SEQ] = seq
+            if self.__cancelled(seq):
+                v[self.cbase + seq % CANCEL_SLOTS] = -seq   # dropped: tell its handle
+                v0 = None           # a move blending into it stopped short
+            elif cmd == "zero":
+                v[b+POS] = 0        # only the worker writes the position
+                v[b+TARGET] = 0
+                Stepper.snapshot.publish(self.index, 0, 0.0, 0)    # and the snapshot
+            else:
+                profile = profile or self.profile or Stepper.profile
+                if cmd == "rel":
+                    delta = val
+                else:  # "abs"
+                    delta = _shortest_delta(self.angle.value, val)
+                ahead = self.__ahead(pending, self.lookahead) if limits(profile) is not None else []
+                v1 = self.__junction(delta, profile, v0, ahead)
+                moved = self.__rotate(delta, profile, v0, v1)
+                v0 = None
+                if not moved:
+                    v[self.cbase + seq % CANCEL_SLOTS] = -seq   # stopped part way
+                if moved and v1 is not None and v1 > limits(profile)[2]:    # still moving: go straight on
+                    into, v0 = ahead[0][3], v1
+            if last:
+                with self.done:     # publish under the lock so a waiter cannot miss it
+                    v[b+DONE] = seq
+                    self.done.notify_all()
+                try:
+                    os.write(self._notify_w, b"\x01")
+                except BlockingIOError:     # nobody is reading; the fd is only a wake-up
+                    pass
+
+    # number of the last command the worker finished
+    def _finished(self) -> int:
+        return Stepper.state.v[self.base+DONE]
+
+    # Worker side: command seq is to be dropped (cancel() up to it, or
+    # cancel(handle) of it, asked or already carried out)
+    def __cancelled(self, seq) -> bool:
+        v = Stepper.state.v
+        return seq <= v[self.base+CANCEL] or abs(v[self.cbase + seq % CANCEL_SLOTS]) == seq
+
+    # Caller side: the worker dropped or stopped command seq
+    def _was_cancelled(self, seq) -> bool:
+        return Stepper.state.v[self.cbase + seq % CANCEL_SLOTS] == -seq
+
+    def __send(self, cmd, val, profile):
+        seq = self._issued + 1
+        if self.ring.full():
+            if self.overflow == "block":
+                self.ring.wait_space()
+            elif self.overflow == "error":
+                raise queue.Full
+            elif self.overflow == "drop_newest":
+                return MoveHandle.reject()
+            else:   # "drop_oldest": mark the command about to be overwritten
+                old = self.ring.oldest()    # as cancelled first; if the worker
+                if old is not None:         # took it meanwhile, it stops there
+                    Stepper.state.v[self.cbase + old % CANCEL_SLOTS] = -old
+        # only this process pushes, so there is room now; with drop_oldest
+        # the oldest pending command is overwritten, and is done once a
+        # later command is
+        if cmd == "prog" or profile is not None:
+            self.queue.put((cmd, val, profile, seq))
+            self.ring.push(EXT, 0.0, seq, overwrite=True)
+        else:
+            self.ring.push(REL if cmd == "rel" else ABS, val, seq, overwrite=True)
+        self._issued += 1
+        return self._handle(self._issued)
+
+    def _handle(self, seq):
+        return MoveHandle(self.done, self._finished, seq, self._was_cancelled)
 
             
-    # Move relative angle from current position:
-    def rotate(self, delta):
-        self.queue.put(("rel", float(delta)))          # queue relative move
+    # Move relative angle from current position (profile overrides the
+    # motor's profile for this move only):
+    def rotate(self, delta, profile=None) -> MoveHandle:
+        return self.__send("rel", float(delta), profile)           # queue relative move
+
+    def goAngle(self, target_angle, profile=None) -> MoveHandle:
+        return self.__send("abs", float(target_angle), profile)    # queue absolute target
+
+    # Queue a list of moves as one command, e.g.
+    #   m.run_program([("abs", 90), ("rel", -45), ("abs", 0, fast_profile)])
+    # profile applies to moves that do not name their own.  The handle
+    # completes when the last move has finished.
+    def run_program(self, moves, profile=None) -> MoveHandle:
+        prog = []
+        for move in moves:
+            if move[0] not in ("rel", "abs"):
+                raise ValueError(f"unknown move {move[0]!r}")
+            prog.append((move[0], float(move[1])) + tuple(move[2:3]))
+        return self.__send("prog", prog, profile)
+
+    # Block until every command sent so far is done (finished or
+    # cancelled); False on timeout
+    def wait(self, timeout=None) -> bool:
+        h = self._handle(self._issued)
+        return h.wait(timeout) or h.done()
+
+
+    # Cancel the command of handle, or every command sent so far.  A
+    # running command stops at its current step; earlier ones are left
+    # alone.
+    def cancel(self, handle=None):
+        v, b = Stepper.state.v, self.base
+        if handle is None:
+            v[b+CANCEL] = max(v[b+CANCEL], self._issued)
+        elif not handle.rejected and not handle.done():
+            v[self.cbase + handle.seq % CANCEL_SLOTS] = handle.seq
+
+    # Affinity, policy, priority and memory locking the worker ended up with
+    # (rt_config), or None if it has not reported within timeout
+    def rt_report(self, timeout=1.0):
+        return self._rt_report.get(timeout)
 
-    def goAngle(self, target_angle):
-        self.queue.put(("abs", float(target_angle)))   # queue absolute target
+    # Change the drive mode ("half", "full" or "wave") from the next move on
+    def set_drive_mode(self, drive_mode):
+        mode = get_mode(drive_mode)
+        Stepper.state.v[self.base+MODE] = MODE_NAMES.index(mode.name)
 
+    # Set the motor zero point, in order with the queued moves (the worker
+    # applies it, so it cannot race a step).  The coil phase is kept so the
+    # next step does not jump the rotor; only the step count restarts.
+    def zero(self) -> MoveHandle:
+        return self.__send("zero", 0.0, None)
 
-    # Set the motor zero point
-    def zero(self):     # set shared angle for this motor to 0
-        with self.angle.get_lock():
-            self.angle.value = 0.0
-        self.step_state = 0
+    # (angle [deg], speed [deg/s], target angle [deg]) of every motor, each
+    # a consistent record, read without a lock
+    @classmethod
+    def read_motion(cls) -> list:
+        spd = cls.steps_per_degree
+        return [((pos/spd) % 360, vel/spd, (target/spd) % 360)
+                for pos, vel, target in cls.snapshot.snapshot(cls.num_steppers)]
 
 
 # Example use:
@@ -150,7 +517,7 @@ if __name__ == '__main__':
         pass
     
     finally:
-        s.shiftByte(0)      # clear outputs
+        s.clear(Stepper.chain_bits.value)      # clear outputs
         time.sleep(0.1)
         GPIO.cleanup()
         print('\nend')
\ No newline at end of file
@@ -0,0 +1,104 @@
+# Hashed timer wheel
+#
+# Schedules callbacks on a ring of tick-wide slots: a timer due at tick t
+# goes into slot t % slots, so scheduling and cancelling are O(1) no matter
+# how many timers are pending, and one pass over the slots that came due
+# fires everything that has expired.  Meant for many periodic jobs (Bug
+# instances, LED blinkers) on one core:
+#
+#   wheel = TimerWheel(tick=0.001)
+#   t = wheel.call_later(0.1, bug_step)
+#   wheel.cancel(t)
+#   while True:
+#       ev = events.get(timeout=wheel.timeout())    # sleep until due or an input
+#       ...
+#       wheel.advance()                             # run what is due
+#
+# Deadlines are absolute (time.monotonic_ns), so a periodic job that
+# reschedules itself at deadline + period does not drift.  Callbacks run
+# late by at most one tick plus whatever the loop was busy with.
+
+import time
+
+
+class Timer:
+    __slots__ = ("deadline_ns", "callback", "args", "cancelled")
+
+    def __init__(self, deadline_ns, callback, args):
+        self.deadline_ns = deadline_ns
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+
+class TimerWheel:
+    def __init__(self, tick=0.001, slots=256):
+        self.tick_ns = int(tick * 1e9)
+        self.slots = [[] for _ in range(slots)]
+        self.count = 0                                  # timers pending
+        self.now_tick = time.monotonic_ns() // self.tick_ns    # last tick advanced to
+
+    # Run callback(*args) at deadline_ns (time.monotonic_ns); returns the Timer
+    def call_at(self, deadline_ns, callback, *args) -> Timer:
+        t = Timer(int(deadline_ns), callback, args)
+        tick = max(-(-t.deadline_ns // self.tick_ns), self.now_tick + 1)  # round up, never in the past
+        self.slots[tick % len(self.slots)].append(t)
+        self.count += 1
+        return t
+
+    # Run callback(*args) in delay seconds
+    def call_later(self, delay, callback, *args) -> Timer:
+        return self.call_at(time.monotonic_ns() + int(delay * 1e9), callback, *args)
+
+    # The timer is dropped when its slot next comes round
+    def cancel(self, t):
+        if not t.cancelled:
+            t.cancelled = True
+            self.count -= 1
+
+    # Seconds until the next timer is due (0 if one is overdue), or None
+    # if nothing is pending
+    def timeout(self):
+        if not self.count:
+            return None
+        n = len(self.slots)
+        first = None
+        for k in range(1, n + 1):   # nearest slot with a timer due this revolution
+            for t in self.slots[(self.now_tick + k) % n]:
+                if not t.cancelled and (first is None or t.deadline_ns < first):
+                    first = t.deadline_ns
+            if first is not None and first <= (self.now_tick + k) * self.tick_ns:
+                break
+        due = -(-first // self.tick_ns) * self.tick_ns     # advance() runs it from that tick
+        return max(0.0, (due - time.monotonic_ns()) / 1e9)
+
+    # Run every timer that is due; returns the number run
+    def advance(self) -> int:
+        target = time.monotonic_ns() // self.tick_ns
+        n = len(self.slots)
+        due_ns = target * self.tick_ns
+        ran = 0
+        # a gap longer than the wheel visits every slot once
+        for tick in range(max(self.now_tick + 1, target - n + 1), target + 1):
+            slot = self.slots[tick % n]
+            if not slot:
+                continue
+            keep = []
+            fire = []
+            for t in slot:
+                if t.cancelled:
+                    pass
+                elif t.deadline_ns <= due_ns:
+                    fire.append(t)
+                else:
+                    keep.append(t)  # a later revolution
+            self.slots[tick % n] = keep
+            for t in fire:          # may schedule new timers
+                if t.cancelled:     # by an earlier callback
+                    continue
+                t.cancelled = True  # spent, so a later cancel() does nothing
+                self.count -= 1
+                t.callback(*t.args)
+                ran += 1
+        self.now_tick = max(self.now_tick, target)
+        return ran